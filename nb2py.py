@@ -9,11 +9,49 @@ Can also be imported as a module:
     nb2py.convert('notebook.ipynb', output_name='script.py')
 """
 import os
+import posixpath
 import argparse
+import io
 import json
+import re
+import subprocess
+import tarfile
+import time
+import zipfile
 
 # Export main functions for module use
-__all__ = ['convert']
+__all__ = ['convert', 'write_script', 'convert_archive', 'strip_outputs', 'pre_commit']
+
+
+def write_script(nb, f_out):
+    """Write the cells of a notebook, loaded as a dict, to a script file."""
+    last_source = ''
+    for cell in nb['cells']:
+        if last_source == 'code' and cell['cell_type'] == 'code':
+            # Check if this is a command cell
+            is_command_cell = 'command' in cell.get('metadata', {}).get('tags', [])
+            if not is_command_cell:
+                f_out.write('#-------------------------------\n\n')
+
+        source = cell['source']
+        if isinstance(source, str):
+            source = source.splitlines(True)
+        for line in source:
+            if cell['cell_type'] == 'markdown':
+                line = '#| ' + line.lstrip()
+            elif cell['cell_type'] == 'code':
+                # Check if this is a command cell
+                is_command_cell = 'command' in cell.get('metadata', {}).get('tags', [])
+                if is_command_cell:
+                    # Remove leading ! if present (from py2nb conversion)
+                    stripped_line = line.lstrip()
+                    if stripped_line.startswith('!'):
+                        stripped_line = stripped_line[1:].lstrip()
+                    line = '#! ' + stripped_line
+            line = line.rstrip() + '\n'
+            f_out.write(line)
+        f_out.write('\n')
+        last_source = cell['cell_type']
 
 
 def convert(notebook_name, output_name=None):
@@ -25,53 +63,322 @@ def convert(notebook_name, output_name=None):
     else:
         script_name = os.path.splitext(notebook_name)[0] + '.py'
     with open(notebook_name, 'r', encoding='utf-8') as f_in:
-        with open(script_name, 'w', encoding='utf-8') as f_out:
-            last_source = ''
-            f_in = json.load(f_in)
-            for cell in f_in['cells']:
-                if last_source == 'code' and cell['cell_type'] == 'code':
-                    # Check if this is a command cell
-                    is_command_cell = 'command' in cell.get('metadata', {}).get('tags', [])
-                    if not is_command_cell:
-                        f_out.write('#-------------------------------\n\n')
-                        
-                for line in cell['source']:
-                    if cell['cell_type'] == 'markdown':
-                        line = '#| ' + line.lstrip()
-                    elif cell['cell_type'] == 'code':
-                        # Check if this is a command cell
-                        is_command_cell = 'command' in cell.get('metadata', {}).get('tags', [])
-                        if is_command_cell:
-                            # Remove leading ! if present (from py2nb conversion)
-                            stripped_line = line.lstrip()
-                            if stripped_line.startswith('!'):
-                                stripped_line = stripped_line[1:].lstrip()
-                            line = '#! ' + stripped_line
-                    line = line.rstrip() + '\n'
-                    f_out.write(line)
-                f_out.write('\n')
-                last_source = cell['cell_type']
+        nb = json.load(f_in)
+    with open(script_name, 'w', encoding='utf-8') as f_out:
+        write_script(nb, f_out)
     
     return script_name
 
 
+def convert_notebook_bytes(data):
+    """Convert the raw bytes of a notebook into the raw bytes of a script."""
+    f_out = io.StringIO()
+    write_script(json.loads(data), f_out)
+    return f_out.getvalue().encode('utf-8')
+
+
+def convert_archive(archive_name, output_name, workers=None, window=None):
+    """Convert every notebook in a tar or zip archive into an output archive.
+
+    Members ending in ``.ipynb`` are written to ``output_name`` as ``.py``
+    members; see `py2nb.stream_archive` for the remaining arguments and the
+    ``(count, failures)`` return value.
+    """
+    from py2nb import stream_archive
+    return stream_archive(archive_name, output_name, convert_notebook_bytes,
+                          '.ipynb', '.py', workers=workers, window=window)
+
+
 def parse_args():
     """Argument parsing for nb2py"""
     description = "Convert a jupyter notebook to a python script"
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument("notebook_name", help="name of notebok (.ipynb) to convert to script (.py)")
+    parser.add_argument("notebook_name", nargs="*", help="name of notebook(s) (.ipynb) to convert to script (.py)")
     parser.add_argument(
         "--output", 
         help="specify output script filename (default: notebook_name.py)")
-    return parser.parse_args() 
+    parser.add_argument(
+        "--archive",
+        metavar="OUTPUT",
+        help="treat notebook_name as a tar/zip archive (or - for stdin) and "
+             "write the converted scripts to the OUTPUT archive")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of worker processes for --archive (default: CPU count)")
+    parser.add_argument(
+        "--changed-since",
+        metavar="REF",
+        help="only convert notebooks changed in git since REF (limited to the "
+             "given notebooks, if any)")
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="write conversion metrics to FILE in the OpenMetrics text format")
+    parser.add_argument(
+        "--pre-commit",
+        action="store_true",
+        help="strip outputs from the given (default: staged) notebooks, "
+             "regenerate their paired scripts and stage the changes")
+    args = parser.parse_args()
+    if not args.notebook_name and not (args.changed_since or args.pre_commit):
+        parser.error("the following arguments are required: notebook_name")
+    return args
+
+
+# A JSON string or a structural character. Strings are matched whole by
+# the regex engine, so large output payloads are skipped without decoding.
+JSON_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[][{}:,]')
+
+
+def skip_value(data, pos):
+    """Return the position just after the JSON array or object starting at pos."""
+    depth = 0
+    while True:
+        m = JSON_TOKEN.search(data, pos)
+        pos = m.end()
+        c = data[m.start()]
+        if c in b'[{':
+            depth += 1
+        elif c in b']}':
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+def strip_outputs(data):
+    """Strip outputs and execution counts from the raw bytes of a notebook.
+
+    The notebook is rewritten as a stream of slices of ``data`` without
+    parsing it, so outputs are skipped over rather than decoded. Code cells
+    keep their formatting, with ``"outputs": []`` and
+    ``"execution_count": null``.
+
+    Returns
+    -------
+    changed: bool
+        Whether anything was stripped
+    chunks: list
+        Pieces of the stripped notebook, to be joined or written in order
+    """
+    view = memoryview(data)
+    chunks = []
+    changed = False
+    copied = 0
+    pos = 0
+    # Open containers as [bracket, key in parent object, current key]
+    stack = []
+    last_string = None
+    while True:
+        m = JSON_TOKEN.search(data, pos)
+        if m is None:
+            break
+        pos = m.end()
+        c = data[m.start()]
+        if c == ord('"'):
+            last_string = m.span()
+        elif c == ord(':'):
+            key = bytes(view[last_string[0] + 1:last_string[1] - 1])
+            stack[-1][2] = key
+            in_cell = (len(stack) == 3 and stack[1][:2] == [ord('['), b'cells']
+                       and stack[2][0] == ord('{'))
+            if in_cell and key == b'outputs':
+                start = JSON_TOKEN.search(data, pos).start()
+                pos = skip_value(data, start)
+                if bytes(view[start + 1:pos - 1]).strip():
+                    changed = True
+                    chunks += [view[copied:start], b'[]']
+                    copied = pos
+            elif in_cell and key == b'execution_count':
+                # The value is a bare number or null, up to the next , or };
+                # the whitespace around it is kept
+                end = JSON_TOKEN.search(data, pos).start()
+                value = bytes(view[pos:end])
+                if value.strip() != b'null':
+                    changed = True
+                    start = pos + len(value) - len(value.lstrip())
+                    chunks += [view[copied:start], b'null']
+                    copied = start + len(value.strip())
+                pos = end
+        elif c in b'[{':
+            parent_key = stack[-1][2] if stack and stack[-1][0] == ord('{') else None
+            stack.append([c, parent_key, None])
+        elif c in b']}':
+            stack.pop()
+    chunks.append(view[copied:])
+    return changed, chunks
+
+
+def staged_notebooks():
+    """Return the paths of notebooks added or modified in the git index."""
+    def git(*args):
+        return subprocess.run(['git'] + list(args), check=True,
+                              capture_output=True, text=True).stdout
+    top = git('rev-parse', '--show-toplevel').strip()
+    names = git('diff', '--cached', '--name-only', '-z', '--diff-filter=ACMR',
+                '--', '*.ipynb')
+    return [os.path.relpath(os.path.join(top, name)) for name in names.split('\0') if name]
+
+
+def staged_blob(path):
+    """Return the mode and contents of a file in the git index.
+
+    Returns ``(None, None)`` if the file is not in the index (or has
+    unresolved merge conflicts).
+    """
+    entry = subprocess.run(['git', 'ls-files', '-s', '-z', '--', path], check=True,
+                           capture_output=True).stdout
+    fields = entry.split(b'\t', 1)[0].split()
+    if not fields or fields[2] != b'0':
+        return None, None
+    data = subprocess.run(['git', 'cat-file', 'blob', fields[1].decode()], check=True,
+                          capture_output=True).stdout
+    return fields[0].decode(), data
+
+
+def stage_blob(path, data, mode='100644'):
+    """Write data into the git index as the contents of path."""
+    sha = subprocess.run(['git', 'hash-object', '-w', '--stdin'], input=data,
+                         check=True, capture_output=True).stdout.decode().strip()
+    # --cacheinfo takes paths relative to the top of the repository
+    prefix = subprocess.run(['git', 'rev-parse', '--show-prefix'], check=True,
+                            capture_output=True, text=True).stdout.strip()
+    path = posixpath.normpath(posixpath.join(prefix, path.replace(os.sep, '/')))
+    subprocess.run(['git', 'update-index', '--add', '--cacheinfo', f'{mode},{sha},{path}'],
+                   check=True, capture_output=True)
+
+
+def pre_commit(notebook_names=None):
+    """Strip outputs from notebooks and regenerate their paired scripts.
+
+    Intended to run from a git pre-commit hook: by default every staged
+    notebook is processed, in one process. The staged version of each
+    notebook is read from the git index and stripped of outputs and
+    execution counts with `strip_outputs`. If a script with the same name
+    exists next to the notebook, it is regenerated from the stripped
+    notebook. Changed files are written straight into the index, so
+    unstaged edits are never committed; the working tree copy is updated
+    too, unless it has unstaged edits of its own.
+
+    Returns
+    -------
+    list of str
+        The files that were changed
+    """
+    if notebook_names is None:
+        notebook_names = staged_notebooks()
+    modified = []
+
+    def update(name, old, new, mode):
+        stage_blob(name, new, mode)
+        try:
+            with open(name, 'rb') as f:
+                clean = f.read() == old
+        except FileNotFoundError:
+            clean = False
+        if clean:
+            tmp = f'{name}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(new)
+            os.replace(tmp, name)
+        modified.append(name)
+
+    for notebook_name in notebook_names:
+        mode, data = staged_blob(notebook_name)
+        if data is None:
+            continue
+        changed, chunks = strip_outputs(data)
+        if changed:
+            update(notebook_name, data, b''.join(chunks), mode)
+
+        script_name = os.path.splitext(notebook_name)[0] + '.py'
+        script_mode, current = staged_blob(script_name)
+        if current is None and not os.path.exists(script_name):
+            continue
+        f_out = io.StringIO()
+        write_script(json.loads(b''.join(chunks)), f_out)
+        script = f_out.getvalue().encode('utf-8')
+        if current != script:
+            update(script_name, current, script, script_mode or '100644')
+    return modified
+
+
+def timed_convert(notebook_name, output_name=None, metrics=None):
+    """Convert a notebook, recording it in a py2nb.Metrics instance if given."""
+    start = time.monotonic()
+    script_name = convert(notebook_name, output_name=output_name)
+    if metrics is not None:
+        metrics.observe('py2nb_conversion_seconds', time.monotonic() - start, direction='nb2py')
+        metrics.inc('py2nb_files_converted', direction='nb2py')
+        metrics.inc('py2nb_bytes_read', os.path.getsize(notebook_name), direction='nb2py')
+        metrics.inc('py2nb_bytes_written', os.path.getsize(script_name), direction='nb2py')
+    print(f"✓ Successfully converted {notebook_name} to {script_name}")
+    return script_name
 
 
 def main():
+    """Main conversion function, returning an exit code."""
     args = parse_args()
-    script_name = convert(args.notebook_name, output_name=args.output)
-    print(f"✓ Successfully converted {args.notebook_name} to {script_name}")
-    return script_name
+    metrics = None
+    if args.metrics:
+        from py2nb import METRICS as metrics
+    try:
+        return run_main(args, metrics)
+    finally:
+        if metrics is not None:
+            metrics.write_textfile(args.metrics)
+
+
+def run_main(args, metrics=None):
+    """Dispatch the command line arguments, returning an exit code."""
+    if args.changed_since:
+        # Scripts of deleted notebooks are left alone: they may be sources
+        from py2nb import git_changes
+        try:
+            changed, _ = git_changes(args.changed_since, '.ipynb')
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"Error: could not query git for changes since {args.changed_since}: {e}")
+            return 1
+        if args.notebook_name:
+            selected = {os.path.abspath(name) for name in args.notebook_name}
+            changed = [name for name in changed if os.path.abspath(name) in selected]
+        for notebook_name in changed:
+            timed_convert(notebook_name, metrics=metrics)
+        if not changed:
+            print(f"✓ No notebooks changed since {args.changed_since}")
+        return 0
+    if args.pre_commit:
+        try:
+            modified = pre_commit(args.notebook_name or None)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"Error: could not update the git index: {e}")
+            return 1
+        for name in modified:
+            print(f"✓ Updated {name}")
+        return 0
+    if args.archive:
+        if len(args.notebook_name) != 1:
+            print("Error: --archive takes a single input archive")
+            return 1
+        archive_name = args.notebook_name[0]
+        try:
+            count, failures = convert_archive(archive_name, args.archive,
+                                              workers=args.workers)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print(f"Error: could not convert archive {archive_name}: {e}")
+            return 1
+        print(f"✓ Successfully converted {count} notebooks from {archive_name} to {args.archive}")
+        if failures:
+            print(f"Error: {len(failures)} notebooks in {archive_name} failed to convert")
+            return 1
+        return 0
+    if args.output and len(args.notebook_name) > 1:
+        print("Error: --output can only be used with a single notebook")
+        return 1
+    for notebook_name in args.notebook_name:
+        timed_convert(notebook_name, output_name=args.output, metrics=metrics)
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    exit(main())
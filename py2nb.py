@@ -9,15 +9,38 @@ Can also be imported as a module:
     py2nb.convert('script.py', execute=True, output_name='notebook.ipynb')
 """
 import argparse
+import ast
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import io
 import os
 import json
+import mmap
+import signal
+import socket
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
 
 import nbformat.v4
 
 # Export main functions for module use
-__all__ = ['convert', 'execute_notebook', 'validate_notebook', 'CELL_SPLIT_CHARS', 'MARKDOWN_CHARS', 'COMMAND_CHARS']
+__all__ = ['convert', 'execute_notebook', 'validate_notebook',
+           'execute_with_checkpoints', 'line_index', 'cell_at_line', 'cell_lines',
+           'script_to_notebook', 'convert_archive', 'stream_archive',
+           'submit_jobs', 'run_worker', 'wait_for_jobs', 'write_manifest',
+           'git_changes', 'write_markdown', 'ExecutionScheduler',
+           'Metrics', 'METRICS', 'shard_cells', 'convert_sharded',
+           'CELL_SPLIT_CHARS', 'MARKDOWN_CHARS', 'COMMAND_CHARS']
 
 # Comment syntax patterns
 CELL_SPLIT_CHARS = ['#-', '# -']
@@ -25,7 +48,93 @@ MARKDOWN_CHARS = ['#|', '# |']
 COMMAND_CHARS = ['#!', '# !', '#%', '# %']
 ACCEPTED_CHARS = CELL_SPLIT_CHARS + MARKDOWN_CHARS + COMMAND_CHARS
 
-def new_cell(nb, cell_content, cell_type='code'):
+
+class Metrics:
+    """Counters and histograms of conversion and execution runs.
+
+    Metric names are registered in ``HELP`` along with their type and
+    description; samples may carry labels as keyword arguments. The
+    process-wide instance is ``METRICS``, written out in the OpenMetrics
+    text format by `write_textfile` (e.g. for the node_exporter textfile
+    collector).
+    """
+
+    HELP = {
+        'py2nb_files_converted': ('counter', 'Files converted'),
+        'py2nb_bytes_read': ('counter', 'Bytes of input read by conversions'),
+        'py2nb_bytes_written': ('counter', 'Bytes of output written by conversions'),
+        'py2nb_cells': ('counter', 'Notebook cells converted, by cell type'),
+        'py2nb_conversion_seconds': ('histogram', 'Time taken to convert a file'),
+        'py2nb_executions': ('counter', 'Notebook executions started'),
+        'py2nb_execution_seconds': ('histogram', 'Time taken to execute a notebook'),
+        'py2nb_execution_failures': ('counter', 'Failed notebook executions, by kind'),
+        'py2nb_cache_hits': ('counter', 'Work reused instead of recomputed, by cache'),
+    }
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800,
+               float('inf'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Increase a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        """Record a value, such as a latency in seconds, in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counts, total = self.histograms.get(key, ([0] * len(self.BUCKETS), 0.0))
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            self.histograms[key] = (counts, total + value)
+
+    def render(self):
+        """Return all metrics in the OpenMetrics text format."""
+        def fmt(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+        lines = []
+        with self.lock:
+            for name, (kind, text) in self.HELP.items():
+                if kind == 'counter':
+                    samples = sorted((k, v) for k, v in self.counters.items() if k[0] == name)
+                    if samples:
+                        lines += [f'# TYPE {name} counter', f'# HELP {name} {text}.']
+                        lines += [f'{name}_total{fmt(labels)} {value}'
+                                  for (_, labels), value in samples]
+                else:
+                    samples = sorted((k, v) for k, v in self.histograms.items() if k[0] == name)
+                    if samples:
+                        lines += [f'# TYPE {name} histogram', f'# HELP {name} {text}.']
+                    for (_, labels), (counts, total) in samples:
+                        for bound, count in zip(self.BUCKETS, counts):
+                            le = '+Inf' if bound == float('inf') else repr(float(bound))
+                            lines.append(f'{name}_bucket{fmt(labels, [("le", le)])} {count}')
+                        lines.append(f'{name}_count{fmt(labels)} {counts[-1]}')
+                        lines.append(f'{name}_sum{fmt(labels)} {total}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically write all metrics to an OpenMetrics text file."""
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+METRICS = Metrics()
+
+def new_cell(nb, cell_content, cell_type='code', lines=None):
     """Create a new cell with proper metadata.
     
     Parameters
@@ -36,6 +145,9 @@ def new_cell(nb, cell_content, cell_type='code'):
         String content for the cell
     cell_type: str, optional
         Type of cell: 'code', 'markdown', or 'command'
+    lines: tuple of int, optional
+        First and last script line (1-based, inclusive) the cell came from,
+        recorded in the cell metadata under ``py2nb.lines``
     
     Returns
     -------
@@ -44,26 +156,27 @@ def new_cell(nb, cell_content, cell_type='code'):
     """
     cell_content = cell_content.rstrip().lstrip()
     if cell_content:
+        # Cells are built with exactly the fields the nbformat 4.2 schema
+        # requires, so no fix-up pass or auto-generated id is needed
         if cell_type == 'markdown':
-            cell = nbformat.v4.new_markdown_cell(cell_content)
-        elif cell_type == 'command':
-            # Create code cell with command content
-            cell = nbformat.v4.new_code_cell(cell_content)
-            # Add metadata to identify as command cell
-            cell.metadata.update({
-                'tags': ['command'],
-                'collapsed': False
-            })
-        else:  # code cell
-            cell = nbformat.v4.new_code_cell(cell_content)
-        
-        # Ensure proper execution count for clean notebooks
-        if hasattr(cell, 'execution_count'):
-            cell.execution_count = None
-            
-        # Ensure outputs field exists and is empty for code cells
-        if cell.cell_type == 'code' and not hasattr(cell, 'outputs'):
-            cell.outputs = []
+            cell = nbformat.NotebookNode(cell_type='markdown',
+                                         metadata=nbformat.NotebookNode(),
+                                         source=cell_content)
+        else:
+            cell = nbformat.NotebookNode(cell_type='code',
+                                         execution_count=None,
+                                         metadata=nbformat.NotebookNode(),
+                                         outputs=[],
+                                         source=cell_content)
+            if cell_type == 'command':
+                # Add metadata to identify as command cell
+                cell.metadata.update({
+                    'tags': ['command'],
+                    'collapsed': False
+                })
+
+        if lines:
+            cell.metadata['py2nb'] = {'lines': list(lines)}
             
         nb.cells.append(cell)
     return ''
@@ -101,110 +214,1025 @@ def extract_content(line, comment_type):
     return ''
 
 
-def convert(script_name, validate=True, execute=False, output_name=None):
-    """Convert the python script to jupyter notebook with enhanced features."""
-    with open(script_name, 'r', encoding='utf-8') as f:
-        # Initialize cells and notebook
-        markdown_cell = ''
-        code_cell = ''
-        command_cell = ''
-        nb = nbformat.v4.new_notebook()
-        
-        # Set notebook metadata (maintain compatibility with existing notebooks)
-        nb.metadata.update({
-            'kernelspec': {
-                'display_name': 'Python 3',
-                'language': 'python',
-                'name': 'python3'
-            },
-            'language_info': {
-                'codemirror_mode': {'name': 'ipython', 'version': 3},
-                'file_extension': '.py',
-                'mimetype': 'text/x-python',
-                'name': 'python',
-                'nbconvert_exporter': 'python',
-                'pygments_lexer': 'ipython3',
-                'version': '3.8.0'
-            }
-        })
-        
-        # Set consistent nbformat version
-        nb.nbformat = 4
-        nb.nbformat_minor = 2
-        
-        for line in f:
-            comment_type = get_comment_type(line)
+def extend_span(spans, cell_type, lineno):
+    """Extend the script line span of the pending cell of the given type."""
+    start, _ = spans.get(cell_type, (lineno, lineno))
+    spans[cell_type] = (start, lineno)
+
+
+def scan_lines(buf):
+    """Yield the ``(start, end)`` byte offsets of each line in a buffer.
+
+    Offsets include the line's newline, so consecutive lines are
+    contiguous. Works on bytes or an mmap without copying the buffer.
+    """
+    start = 0
+    size = len(buf)
+    while start < size:
+        end = buf.find(b'\n', start)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def normalise_newlines(data):
+    """Convert ``\\r\\n`` and ``\\r`` line endings in bytes to ``\\n``."""
+    return data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+
+def script_to_notebook(lines, validate=True, line_map=False, strict=False):
+    """Build a notebook from the lines of a python script.
+
+    Parameters
+    ----------
+    lines: iterable of str
+        Script lines, including their line endings
+    validate: bool, optional
+        Validate the notebook. Cells are valid by construction, so this only
+        has an effect together with ``strict``
+    line_map: bool, optional
+        Record the script lines each cell came from (see `convert`)
+    strict: bool, optional
+        Check the notebook against the nbformat schema (see
+        `validate_notebook`)
+
+    Returns
+    -------
+    nbformat.notebooknode.NotebookNode
+    """
+    data = normalise_newlines(''.join(lines).encode('utf-8'))
+    return buffer_to_notebook(data, validate=validate, line_map=line_map,
+                              strict=strict)
+
+
+def buffer_to_notebook(buf, validate=True, line_map=False, strict=False):
+    """Build a notebook from a UTF-8 script held in bytes or an mmap.
+
+    Line and marker boundaries are found on the raw bytes; only the lines
+    that make up cells are decoded, with each code cell decoded as a single
+    slice. ``buf`` must use ``\\n`` line endings (see
+    `normalise_newlines`). See `script_to_notebook` for the other arguments.
+    """
+    # Initialize cells and notebook
+    markdown_cell = ''
+    command_cell = ''
+    # Byte range of the pending code cell; its lines are always contiguous
+    code_range = None
+    nb = nbformat.v4.new_notebook()
+    
+    # Set notebook metadata (maintain compatibility with existing notebooks)
+    nb.metadata.update({
+        'kernelspec': {
+            'display_name': 'Python 3',
+            'language': 'python',
+            'name': 'python3'
+        },
+        'language_info': {
+            'codemirror_mode': {'name': 'ipython', 'version': 3},
+            'file_extension': '.py',
+            'mimetype': 'text/x-python',
+            'name': 'python',
+            'nbconvert_exporter': 'python',
+            'pygments_lexer': 'ipython3',
+            'version': '3.8.0'
+        }
+    })
+    
+    # Set consistent nbformat version
+    nb.nbformat = 4
+    nb.nbformat_minor = 2
+    
+    # Comment markers as bytes, checked against the start of each line
+    markers = [(tuple(c.encode('utf-8') for c in COMMAND_CHARS), 'command'),
+               (tuple(c.encode('utf-8') for c in MARKDOWN_CHARS), 'markdown'),
+               (tuple(c.encode('utf-8') for c in CELL_SPLIT_CHARS), 'split')]
+    head_size = max(len(c) for prefixes, _ in markers for c in prefixes)
+
+    # Script line spans of the pending cells, keyed by cell type
+    spans = {}
+
+    def finish(cell_content, cell_type):
+        lines = spans.pop(cell_type, None)
+        return new_cell(nb, cell_content, cell_type, lines if line_map else None)
+
+    def finish_code():
+        if code_range is not None:
+            finish(buf[code_range[0]:code_range[1]].decode('utf-8'), 'code')
+        return None
+
+    for lineno, (start, end) in enumerate(scan_lines(buf), 1):
+        head = buf[start:start + head_size]
+        comment_type = None
+        for prefixes, kind in markers:
+            if head.startswith(prefixes):
+                comment_type = kind
+                break
             
-            if comment_type:
-                # Finish current code cell before processing comment
-                code_cell = new_cell(nb, code_cell, 'code')
-                
-                if comment_type == 'markdown':
-                    # Add to markdown cell
-                    markdown_cell += extract_content(line, 'markdown')
-                elif comment_type == 'command':
-                    # Finish any pending markdown cell
-                    markdown_cell = new_cell(nb, markdown_cell, 'markdown')
-                    # Add to command cell
-                    command_cell += extract_content(line, 'command') + '\n'
-                elif comment_type == 'split':
-                    # Finish any pending cells and start fresh
-                    markdown_cell = new_cell(nb, markdown_cell, 'markdown')
-                    command_cell = new_cell(nb, command_cell, 'command')
+        if comment_type:
+            # Finish current code cell before processing comment
+            code_range = finish_code()
+            line = buf[start:end].decode('utf-8')
+            
+            if comment_type == 'markdown':
+                # Add to markdown cell
+                markdown_cell += extract_content(line, 'markdown')
+                extend_span(spans, 'markdown', lineno)
+            elif comment_type == 'command':
+                # Finish any pending markdown cell
+                markdown_cell = finish(markdown_cell, 'markdown')
+                # Add to command cell
+                command_cell += extract_content(line, 'command') + '\n'
+                extend_span(spans, 'command', lineno)
+            elif comment_type == 'split':
+                # Finish any pending cells and start fresh
+                markdown_cell = finish(markdown_cell, 'markdown')
+                command_cell = finish(command_cell, 'command')
+        else:
+            # Regular code line - finish pending markdown/command cells
+            markdown_cell = finish(markdown_cell, 'markdown')
+            command_cell = finish(command_cell, 'command')
+            # Add to code cell
+            code_range = (code_range[0] if code_range else start, end)
+            if line_map and buf[start:end].strip():
+                extend_span(spans, 'code', lineno)
+
+    # Finish any remaining cells
+    markdown_cell = finish(markdown_cell, 'markdown')
+    command_cell = finish(command_cell, 'command')
+    code_range = finish_code()
+
+    if validate and strict:
+        validate_notebook(nb, strict=True)
+
+    return nb
+
+
+@contextlib.contextmanager
+def open_script(script_name):
+    """Memory-map a script and yield its contents as a byte buffer.
+
+    Empty files, and files with ``\\r`` line endings (which are normalised
+    in memory), yield bytes instead of an mmap.
+    """
+    with open(script_name, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf.find(b'\r') != -1:
+                yield normalise_newlines(buf[:])
             else:
-                # Regular code line - finish pending markdown/command cells
-                markdown_cell = new_cell(nb, markdown_cell, 'markdown')
-                command_cell = new_cell(nb, command_cell, 'command')
-                # Add to code cell
-                code_cell += line
-
-        # Finish any remaining cells
-        markdown_cell = new_cell(nb, markdown_cell, 'markdown')
-        command_cell = new_cell(nb, command_cell, 'command')
-        code_cell = new_cell(nb, code_cell, 'code')
-
-        # Validate notebook structure if requested
-        if validate:
-            validate_notebook(nb)
-
-        # Write notebook with consistent format (avoid auto-generated ids)
-        if output_name:
-            notebook_name = output_name
-            if not notebook_name.endswith('.ipynb'):
-                notebook_name += '.ipynb'
+                yield buf
+
+
+# File extension of each output target of convert
+TARGET_EXTENSIONS = {'ipynb': '.ipynb', 'md': '.md', 'py': '.py'}
+
+
+def output_path(script_name, output_name=None, target='ipynb'):
+    """Return the output filename for a script, output name and target.
+
+    Any target extension already on ``output_name`` is replaced, so one
+    output name serves all targets.
+    """
+    if output_name:
+        base = output_name
+        for ext in TARGET_EXTENSIONS.values():
+            if base.endswith(ext):
+                base = base[:-len(ext)]
+                break
+    else:
+        base = os.path.splitext(script_name)[0]
+    return base + TARGET_EXTENSIONS[target]
+
+
+def write_markdown(nb, f):
+    """Write a notebook as markdown, with code cells as fenced blocks."""
+    for i, cell in enumerate(nb.cells):
+        if i:
+            f.write('\n')
+        source = cell.source
+        if not isinstance(source, str):
+            source = ''.join(source)
+        if cell.cell_type == 'markdown':
+            f.write(source.rstrip() + '\n')
         else:
-            notebook_name = os.path.splitext(script_name)[0] + '.ipynb'
-        
-        # Remove any auto-generated cell ids to maintain clean format
-        for cell in nb.cells:
-            if 'id' in cell:
-                del cell['id']
-        
-        # Write with explicit version to avoid nbformat_minor changes
-        with open(notebook_name, 'w', encoding='utf-8') as f:
-            nbformat.write(nb, f, version=nbformat.NO_CONVERT)
-        
-        # Execute notebook if requested
-        if execute:
-            executed_name = execute_notebook(notebook_name)
-            return executed_name
-        
-        return notebook_name
+            f.write('```python\n' + source.rstrip() + '\n```\n')
+
+
+def write_outputs(nb, script_name, output_name=None, to=('ipynb',)):
+    """Write a notebook to each requested target, returning the paths.
+
+    Every target and path is checked before anything is written, so a bad
+    target never leaves a partial set of outputs behind.
+    """
+    from nb2py import write_script
+
+    paths = []
+    for target in to:
+        if target not in TARGET_EXTENSIONS:
+            raise ValueError(f"Unknown output target {target!r}, "
+                             f"choose from {', '.join(TARGET_EXTENSIONS)}")
+        path = output_path(script_name, output_name, target)
+        if os.path.abspath(path) == os.path.abspath(script_name):
+            raise ValueError(f"Writing {target} output would overwrite {script_name}, "
+                             "choose a different output name")
+        paths.append(path)
+
+    for target, path in zip(to, paths):
+        with open(path, 'w', encoding='utf-8') as f:
+            if target == 'ipynb':
+                # Serialise directly: nbformat.write would re-validate
+                f.write(nbformat.v4.writes(nb) + '\n')
+            elif target == 'md':
+                write_markdown(nb, f)
+            elif target == 'py':
+                write_script(nb, f)
+    return paths
+
+
+def convert(script_name, validate=True, execute=False, output_name=None,
+            line_map=False, to='ipynb', strict=False, checkpoint=None,
+            resume=False):
+    """Convert the python script to jupyter notebook with enhanced features.
+
+    If ``line_map`` is set, each cell records the script lines it was built
+    from in ``cell.metadata['py2nb']['lines']`` as ``[first, last]``
+    (1-based, inclusive). See `line_index`, `cell_at_line` and `cell_lines`.
+
+    ``to`` selects the output target, or a list of targets, from ``'ipynb'``,
+    ``'md'`` (markdown) and ``'py'`` (a normalised script, as written by
+    nb2py). All targets are written from a single parse of the script,
+    named after ``output_name`` (or the script) with the target's
+    extension. A single target returns its path, several return a list.
+
+    ``strict`` checks the notebook against the nbformat schema before
+    writing, raising ``nbformat.ValidationError`` if it does not conform.
+
+    ``checkpoint`` and ``resume`` are passed on to `execute_notebook`. When
+    resuming, an existing checkpoint built from the same script is kept
+    rather than overwritten by a fresh notebook.
+    """
+    targets = [to] if isinstance(to, str) else list(to)
+    start = time.monotonic()
+
+    with open_script(script_name) as buf:
+        nb = buffer_to_notebook(buf, validate=validate, line_map=line_map,
+                                strict=strict)
+
+    write_targets = targets
+    if execute and resume and 'ipynb' in targets:
+        notebook_name = output_path(script_name, output_name, 'ipynb')
+        if is_resumable(notebook_name, nb):
+            write_targets = [t for t in targets if t != 'ipynb']
+    paths = write_outputs(nb, script_name, output_name, write_targets)
+    if write_targets is not targets:
+        paths.insert(targets.index('ipynb'), notebook_name)
+
+    METRICS.observe('py2nb_conversion_seconds', time.monotonic() - start, direction='py2nb')
+    METRICS.inc('py2nb_files_converted', direction='py2nb')
+    METRICS.inc('py2nb_bytes_read', os.path.getsize(script_name), direction='py2nb')
+    METRICS.inc('py2nb_bytes_written', sum(os.path.getsize(path) for path in paths),
+                direction='py2nb')
+    for cell in nb.cells:
+        if 'command' in cell.metadata.get('tags', []):
+            METRICS.inc('py2nb_cells', type='command')
+        else:
+            METRICS.inc('py2nb_cells', type=cell.cell_type)
+
+    # Execute notebook if requested
+    if execute and 'ipynb' in targets:
+        i = targets.index('ipynb')
+        paths[i] = execute_notebook(paths[i], checkpoint=checkpoint,
+                                    resume=resume)
+
+    if isinstance(to, str):
+        return paths[0]
+    return paths
+
+
+def heading_level(cell):
+    """Return the level of a markdown heading starting a cell, or None."""
+    if cell.cell_type != 'markdown':
+        return None
+    first = cell.source.lstrip().split('\n', 1)[0]
+    level = len(first) - len(first.lstrip('#'))
+    if level and first[level:level + 1] == ' ':
+        return level
+    return None
+
 
+def shard_cells(cells, headings=None, max_cells=None, max_bytes=None):
+    """Split a list of cells into consecutive shards.
 
-def execute_notebook(notebook_path):
-    """Execute a notebook using nbconvert and return the executed notebook path."""
+    Parameters
+    ----------
+    cells: list
+        Notebook cells
+    headings: int, optional
+        Start a new shard at every markdown heading of this level or higher
+        (1 for ``#`` only, 2 for ``#`` and ``##``, ...)
+    max_cells: int, optional
+        Maximum number of cells per shard
+    max_bytes: int, optional
+        Maximum total source size per shard, in bytes. A single cell larger
+        than this gets a shard of its own
+
+    Returns
+    -------
+    list of list
+        The shards, each a non-empty list of cells
+    """
+    shards = []
+    current = []
+    size = 0
+    for cell in cells:
+        cell_size = len(cell.source.encode('utf-8'))
+        level = heading_level(cell)
+        if current and ((headings and level and level <= headings)
+                        or (max_cells and len(current) >= max_cells)
+                        or (max_bytes and size + cell_size > max_bytes)):
+            shards.append(current)
+            current = []
+            size = 0
+        current.append(cell)
+        size += cell_size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def import_statements(cells):
+    """Collect the top-level import statements of code cells, in order.
+
+    Shell and magic lines (``!pip ...``, ``%time ...``) are ignored, as are
+    cells that do not parse.
+    """
+    statements = []
+    for cell in cells:
+        if cell.cell_type != 'code':
+            continue
+        source = '\n'.join('' if line.lstrip()[:1] in ('!', '%') else line
+                           for line in cell.source.split('\n'))
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            continue
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                statement = ast.get_source_segment(source, node)
+                if statement not in statements:
+                    statements.append(statement)
+    return statements
+
+
+def imports_cell(statements):
+    """Create a code cell repeating import statements of earlier shards."""
+    return nbformat.NotebookNode(cell_type='code', execution_count=None,
+                                 metadata=nbformat.NotebookNode(tags=['py2nb-imports']),
+                                 outputs=[], source='\n'.join(statements))
+
+
+def state_cell(state, state_file, save):
+    """Create a code cell saving or loading variables between shards.
+
+    Modules are saved by name and imported again on loading; other values
+    that cannot be pickled are skipped with a warning.
+    """
+    if save:
+        source = (f"import pickle, types\n"
+                  f"_py2nb_state = {{}}\n"
+                  f"for _name in {state!r}:\n"
+                  f"    if _name not in globals():\n"
+                  f"        continue\n"
+                  f"    _value = globals()[_name]\n"
+                  f"    try:\n"
+                  f"        if isinstance(_value, types.ModuleType):\n"
+                  f"            _py2nb_state[_name] = ('module', _value.__name__)\n"
+                  f"        else:\n"
+                  f"            _py2nb_state[_name] = ('pickle', pickle.dumps(_value))\n"
+                  f"    except Exception as e:\n"
+                  f"        print(f'⚠ Not saving {{_name}}: {{e}}')\n"
+                  f"with open({state_file!r}, 'wb') as f:\n"
+                  f"    pickle.dump(_py2nb_state, f)")
+    else:
+        source = (f"import importlib, pickle\n"
+                  f"with open({state_file!r}, 'rb') as f:\n"
+                  f"    for _name, (_kind, _value) in pickle.load(f).items():\n"
+                  f"        globals()[_name] = (importlib.import_module(_value) if _kind == 'module'\n"
+                  f"                            else pickle.loads(_value))")
+    return nbformat.NotebookNode(cell_type='code', execution_count=None,
+                                 metadata=nbformat.NotebookNode(tags=['py2nb-state']),
+                                 outputs=[], source=source)
+
+
+def convert_sharded(script_name, output_name=None, headings=None,
+                    max_cells=None, max_bytes=None, state=None, validate=True,
+                    execute=False, line_map=False, strict=False):
+    """Convert a script into several shard notebooks plus an index notebook.
+
+    The cells are split with `shard_cells`. Shard ``k`` is written to
+    ``<output>_<k>.ipynb``, and ``<output>.ipynb`` becomes an index notebook
+    linking to the shards. Here ``<output>`` is ``output_name`` or the
+    script name without its extension.
+
+    Every shard after the first starts by repeating the top-level import
+    statements of the shards before it (see `import_statements`).
+
+    If ``state`` lists variable names, each shard but the last ends by
+    pickling those variables to ``<output>_state_<k>.pkl``, and the next
+    shard starts by loading them (see `state_cell`). Shards then have to run
+    in order. Without ``state`` they can run independently, provided they do
+    not share variables.
+
+    With ``execute``, the shards are executed in order, stopping with a
+    ``RuntimeError`` at the first one that fails.
+
+    Returns
+    -------
+    list of str
+        The index notebook path followed by the shard paths
+    """
+    with open_script(script_name) as buf:
+        nb = buffer_to_notebook(buf, validate=validate, line_map=line_map,
+                                strict=strict)
+
+    base = output_path(script_name, output_name, 'ipynb')[:-len('.ipynb')]
+    shards = shard_cells(nb.cells, headings=headings, max_cells=max_cells,
+                         max_bytes=max_bytes)
+    width = max(2, len(str(len(shards))))
+
+    index = nbformat.v4.new_notebook(metadata=nb.metadata,
+                                     nbformat=nb.nbformat,
+                                     nbformat_minor=nb.nbformat_minor)
+    def state_file(k):
+        return f'{os.path.basename(base)}_state_{k:0{width}d}.pkl'
+
+    links = []
+    paths = []
+    imports = []
+    for k, cells in enumerate(shards, 1):
+        cells = list(cells)
+        if state and k > 1:
+            cells.insert(0, state_cell(state, state_file(k - 1), save=False))
+        if imports:
+            cells.insert(0, imports_cell(imports))
+        imports += [statement for statement in import_statements(shards[k - 1])
+                    if statement not in imports]
+        if state and k < len(shards):
+            cells.append(state_cell(state, state_file(k), save=True))
+        shard = nbformat.v4.new_notebook(cells=cells, metadata=nb.metadata,
+                                         nbformat=nb.nbformat,
+                                         nbformat_minor=nb.nbformat_minor)
+        paths += write_outputs(shard, script_name, f'{base}_{k:0{width}d}')
+
+        title = next((c.source.lstrip().split('\n', 1)[0].lstrip('#').strip()
+                      for c in cells if heading_level(c)), f'Part {k}')
+        links.append(f'{k}. [{title}]({os.path.basename(paths[-1])})')
+
+    index.cells.append(nbformat.NotebookNode(
+        cell_type='markdown', metadata=nbformat.NotebookNode(),
+        source=f'# {os.path.basename(script_name)}\n\n' + '\n'.join(links)))
+    paths = write_outputs(index, script_name, base) + paths
+
+    if execute:
+        for path in paths[1:]:
+            execute_notebook(path, check=True)
+    return paths
+
+
+def convert_script_bytes(data, validate=True, line_map=False):
+    """Convert the raw bytes of a script into the raw bytes of a notebook."""
+    nb = buffer_to_notebook(normalise_newlines(data), validate=validate,
+                            line_map=line_map)
+    return (nbformat.v4.writes(nb) + '\n').encode('utf-8')
+
+
+def iter_archive(archive_name, suffix):
+    """Yield ``(name, data)`` for archive members ending in ``suffix``.
+
+    Zip files are read through their central directory; anything else is
+    read as a (possibly compressed) tar stream, so ``'-'`` reads stdin.
+    """
+    if archive_name != '-' and zipfile.is_zipfile(archive_name):
+        with zipfile.ZipFile(archive_name) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.endswith(suffix):
+                    yield info.filename, zf.read(info)
+        return
+
+    if archive_name == '-':
+        tf = tarfile.open(fileobj=sys.stdin.buffer, mode='r|*')
+    else:
+        tf = tarfile.open(archive_name, mode='r|*')
+    with tf:
+        for info in tf:
+            if info.isfile() and info.name.endswith(suffix):
+                yield info.name, tf.extractfile(info).read()
+
+
+@contextlib.contextmanager
+def archive_writer(output_name):
+    """Open an output archive and yield a ``write(name, data)`` function.
+
+    The format follows the extension of ``output_name``: ``.zip`` writes a
+    zip file, ``.tar.gz``/``.tgz``, ``.tar.bz2`` and ``.tar.xz`` write a
+    compressed tar stream, anything else an uncompressed tar stream.
+    """
+    if output_name.endswith('.zip'):
+        with zipfile.ZipFile(output_name, 'w', zipfile.ZIP_DEFLATED) as zf:
+            yield zf.writestr
+        return
+
+    compression = ''
+    for ext, comp in [('.gz', 'gz'), ('.tgz', 'gz'), ('.bz2', 'bz2'), ('.xz', 'xz')]:
+        if output_name.endswith(ext):
+            compression = comp
+    with tarfile.open(output_name, 'w|' + compression) as tf:
+        def write(name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tf.addfile(info, io.BytesIO(data))
+        yield write
+
+
+def stream_archive(archive_name, output_name, converter, suffix, new_suffix,
+                   workers=None, window=None):
+    """Convert archive members into an output archive without extracting.
+
+    Parameters
+    ----------
+    archive_name: str
+        Input tar or zip archive (``'-'`` for a tar stream on stdin)
+    output_name: str
+        Output archive, format chosen by extension (see `archive_writer`)
+    converter: callable
+        Picklable function mapping member bytes to converted bytes
+    suffix, new_suffix: str
+        Extension of members to convert, and of the converted members
+    workers: int, optional
+        Number of worker processes (default: number of CPUs)
+    window: int, optional
+        Maximum number of members held in memory at once
+        (default: four per worker)
+
+    Returns
+    -------
+    count: int
+        Number of members converted
+    failures: list of str
+        Names of the input members that could not be converted; these are
+        reported as they happen and left out of the output archive
+
+    An input archive that cannot be read raises ``OSError``,
+    ``tarfile.TarError`` or ``zipfile.BadZipFile``; the output archive is
+    then removed.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    count = 0
+    failures = []
+    pending = collections.deque()
+
+    def flush(name, new_name, future):
+        try:
+            data = future.result()
+            write(new_name, data)
+            METRICS.inc('py2nb_files_converted', direction=suffix[1:] + '2' + new_suffix[1:])
+            METRICS.inc('py2nb_bytes_written', len(data), direction=suffix[1:] + '2' + new_suffix[1:])
+            return 1
+        except Exception as e:
+            print(f"⚠ Error converting {name}: {e}")
+            failures.append(name)
+            return 0
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool, \
+                archive_writer(output_name) as write:
+            for name, data in iter_archive(archive_name, suffix):
+                new_name = name[:-len(suffix)] + new_suffix
+                METRICS.inc('py2nb_bytes_read', len(data), direction=suffix[1:] + '2' + new_suffix[1:])
+                pending.append((name, new_name, pool.submit(converter, data)))
+                # Members are written in input order once the window is full
+                if len(pending) >= window:
+                    count += flush(*pending.popleft())
+            while pending:
+                count += flush(*pending.popleft())
+    except BaseException:
+        # Do not leave a partial output archive behind
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(output_name)
+        raise
+    return count, failures
+
+
+def convert_archive(archive_name, output_name, validate=True, line_map=False,
+                    workers=None, window=None):
+    """Convert every script in a tar or zip archive into an output archive.
+
+    Members ending in ``.py`` are converted in a pool of worker processes and
+    written to ``output_name`` as ``.ipynb`` members; other members are
+    skipped. See `stream_archive` for the meaning of ``workers`` and
+    ``window``, and for the ``(count, failures)`` return value.
+    """
+    converter = functools.partial(convert_script_bytes,
+                                  validate=validate, line_map=line_map)
+    return stream_archive(archive_name, output_name, converter, '.py', '.ipynb',
+                          workers=workers, window=window)
+
+
+# Shared-directory work queue. Jobs are JSON files moved between
+# subdirectories of the queue directory with atomic renames:
+#   pending/<job>.json -> claimed/<job>.<worker>.json
+#                      -> (removed once results/<job>.json is written)
+# Claims carry the worker id, so a worker only ever touches or removes its
+# own claim, even if the job was reclaimed and claimed again meanwhile.
+# A worker touches its claimed job file every ``heartbeat`` seconds; any
+# worker or coordinator may move a claimed job whose file is older than
+# ``stale`` seconds back to pending/. Jobs therefore run at least once.
+QUEUE_DIRS = ['pending', 'claimed', 'results']
+
+
+def atomic_write_json(path, data):
+    """Write JSON to path via a temporary file and an atomic rename."""
+    tmp = f'{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def submit_jobs(queue_dir, script_names, execute=False, validate=True,
+                line_map=False):
+    """Add a conversion job for each script to a shared queue directory.
+
+    Returns
+    -------
+    list of str
+        The job ids, in submission order
+    """
+    for sub in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+    job_ids = []
+    for script_name in script_names:
+        job_id = f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}'
+        job = {'job': job_id,
+               'script': os.path.abspath(script_name),
+               'execute': execute,
+               'validate': validate,
+               'line_map': line_map}
+        atomic_write_json(os.path.join(queue_dir, 'pending', job_id + '.json'), job)
+        job_ids.append(job_id)
+    return job_ids
+
+
+def claim_job(queue_dir, worker_id):
+    """Claim the oldest pending job, returning its claimed path or None."""
+    pending = os.path.join(queue_dir, 'pending')
+    for name in sorted(os.listdir(pending)):
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-len('.json')]
+        claimed = os.path.join(queue_dir, 'claimed', f'{job_id}.{worker_id}.json')
+        try:
+            os.rename(os.path.join(pending, name), claimed)
+        except FileNotFoundError:
+            # Another worker got there first
+            continue
+        os.utime(claimed)
+        return claimed
+    return None
+
+
+def reclaim_stale(queue_dir, stale=60):
+    """Move claimed jobs without a recent heartbeat back to pending.
+
+    Returns
+    -------
+    int
+        Number of jobs reclaimed
+    """
+    count = 0
+    claimed = os.path.join(queue_dir, 'claimed')
+    now = time.time()
+    for name in os.listdir(claimed):
+        path = os.path.join(claimed, name)
+        try:
+            if now - os.path.getmtime(path) > stale:
+                # Job ids contain no dots; the rest is the worker id
+                job_id = name.split('.', 1)[0]
+                os.rename(path, os.path.join(queue_dir, 'pending', job_id + '.json'))
+                count += 1
+        except FileNotFoundError:
+            continue
+    return count
+
+
+def heartbeat(path, interval, stop):
+    """Touch path every interval seconds until stop is set or it vanishes."""
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+def run_job(job):
+    """Run a queued conversion job and return the converted notebook path.
+
+    A failed execution raises, so that the job is recorded as failed.
+    """
+    notebook_name = convert(job['script'], validate=job['validate'],
+                            line_map=job['line_map'])
+    if job['execute']:
+        notebook_name = execute_notebook(notebook_name, check=True)
+    return notebook_name
+
+
+def run_worker(queue_dir, worker_id=None, heartbeat_interval=10, stale=60,
+               poll=1):
+    """Process jobs from a shared queue directory until it is drained.
+
+    The worker exits once no jobs are pending or claimed, reclaiming jobs
+    of dead workers on the way, so several workers (on one or many hosts)
+    can be pointed at the same directory.
+
+    Returns
+    -------
+    int
+        Number of jobs this worker completed
+    """
+    worker_id = (worker_id or f'{socket.gethostname()}-{os.getpid()}').replace(os.sep, '-')
+    for sub in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+    count = 0
+    while True:
+        reclaim_stale(queue_dir, stale)
+        claimed = claim_job(queue_dir, worker_id)
+        if claimed is None:
+            if not os.listdir(os.path.join(queue_dir, 'claimed')):
+                return count
+            time.sleep(poll)
+            continue
+
+        with open(claimed, 'r', encoding='utf-8') as f:
+            job = json.load(f)
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat,
+                                args=(claimed, heartbeat_interval, stop),
+                                daemon=True)
+        beat.start()
+        result = dict(job, worker=worker_id, started=time.time())
+        try:
+            result['output'] = run_job(job)
+            result['status'] = 'done'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = f'{type(e).__name__}: {e}'
+        finally:
+            stop.set()
+            beat.join()
+        result['finished'] = time.time()
+
+        atomic_write_json(os.path.join(queue_dir, 'results', job['job'] + '.json'), result)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(claimed)
+        count += 1
+
+
+def write_manifest(queue_dir, job_ids=None):
+    """Collect job results into ``manifest.json`` in the queue directory.
+
+    If ``job_ids`` is given, only the results of those jobs are collected,
+    so a reused queue directory does not report jobs of earlier runs.
+
+    Returns
+    -------
+    list of dict
+        The job results, ordered by job id
+    """
+    results_dir = os.path.join(queue_dir, 'results')
+    if job_ids is None:
+        names = [name for name in os.listdir(results_dir) if name.endswith('.json')]
+    else:
+        names = [job_id + '.json' for job_id in job_ids]
+    results = []
+    for name in sorted(names):
+        with open(os.path.join(results_dir, name), 'r', encoding='utf-8') as f:
+            results.append(json.load(f))
+    atomic_write_json(os.path.join(queue_dir, 'manifest.json'), results)
+    return results
+
+
+def wait_for_jobs(queue_dir, job_ids=None, stale=60, poll=1):
+    """Wait for jobs to finish, then write and return their manifest.
+
+    Waits for the given ``job_ids``, or for the whole queue to drain. While
+    waiting, jobs of dead workers are moved back to pending.
+    """
+    def busy():
+        if job_ids is None:
+            return (os.listdir(os.path.join(queue_dir, 'pending'))
+                    or os.listdir(os.path.join(queue_dir, 'claimed')))
+        return any(not os.path.exists(os.path.join(queue_dir, 'results', job_id + '.json'))
+                   for job_id in job_ids)
+
+    while busy():
+        reclaim_stale(queue_dir, stale)
+        time.sleep(poll)
+    return write_manifest(queue_dir, job_ids)
+
+
+def git_changes(ref, suffix, cwd=None):
+    """Find files with a given suffix changed in git since a reference.
+
+    Compares ``ref`` against the working tree below ``cwd``, so staged,
+    unstaged and untracked (but not ignored) files all count as changed. Renamed files
+    count as a deletion of the old path plus a change of the new one.
+
+    Parameters
+    ----------
+    ref: str
+        Any git revision, e.g. ``origin/master`` or ``HEAD~3``
+    suffix: str
+        File extension to select, e.g. ``'.py'``
+    cwd: str, optional
+        Directory inside the repository (default: current directory)
+
+    Returns
+    -------
+    changed, deleted: list of str
+        Paths relative to ``cwd``, in git order
+    """
+    cwd = cwd or os.getcwd()
+
+    def git(*args):
+        return subprocess.run(['git'] + list(args), cwd=cwd, check=True,
+                              capture_output=True, text=True).stdout
+
+    top = git('rev-parse', '--show-toplevel').strip()
+    tokens = git('diff', '--name-status', '-M', '-z', ref, '--', '.').split('\0')
+
+    changed = []
+    deleted = []
+    i = 0
+    while i < len(tokens) and tokens[i]:
+        status = tokens[i][0]
+        if status in 'RC':
+            old, new = tokens[i + 1], tokens[i + 2]
+            i += 3
+            if status == 'R':
+                deleted.append(old)
+        else:
+            new = tokens[i + 1]
+            i += 2
+            if status == 'D':
+                deleted.append(new)
+                continue
+        changed.append(new)
+
+    untracked = git('ls-files', '--others', '--exclude-standard', '--full-name', '-z')
+    changed += [path for path in untracked.split('\0') if path]
+
+    def select(paths):
+        return [os.path.relpath(os.path.join(top, path), cwd)
+                for path in paths if path.endswith(suffix)]
+    return select(changed), select(deleted)
+
+
+def write_checkpoint(nb, notebook_path):
+    """Atomically replace a notebook file with the given notebook."""
+    tmp = f'{notebook_path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(nbformat.v4.writes(nb) + '\n')
+    os.replace(tmp, notebook_path)
+
+
+def is_resumable(notebook_path, nb):
+    """Check for a partial execution checkpoint of the same cells as nb."""
+    try:
+        checkpoint = nbformat.read(notebook_path, as_version=4)
+    except (OSError, ValueError):
+        return False
+    if 'executed_cells' not in checkpoint.metadata.get('py2nb', {}):
+        return False
+    return ([(c.cell_type, c.source) for c in checkpoint.cells]
+            == [(c.cell_type, c.source) for c in nb.cells])
+
+
+def execute_with_checkpoints(notebook_path, checkpoint=0, resume=False,
+                             timeout=300, check=False):
+    """Execute a notebook cell by cell, saving progress as it goes.
+
+    After each cell, or at most every ``checkpoint`` seconds, the partially
+    executed notebook is written back atomically, with the number of
+    completed cells in ``metadata['py2nb']['executed_cells']``. With
+    ``resume``, execution restarts after the last completed cell of such a
+    checkpoint. The completed cells are first replayed in the fresh kernel
+    to restore the names they defined, keeping their checkpointed outputs,
+    so any side effects they have happen again.
+
+    Requires ``nbclient``; ``timeout`` applies to each cell.
+    """
+    try:
+        import nbclient
+    except ImportError:
+        METRICS.inc('py2nb_execution_failures', kind='missing_jupyter')
+        print("⚠ nbclient not found. Install with: pip install nbclient")
+        print(f"  Original notebook available: {notebook_path}")
+        return execution_failed(notebook_path, check)
+
+    nb = nbformat.read(notebook_path, as_version=4)
+    state = nb.metadata.setdefault('py2nb', {})
+    start = state.get('executed_cells', 0) if resume else 0
+    if start:
+        METRICS.inc('py2nb_cache_hits', start, cache='checkpoint')
+        print(f"  Resuming {notebook_path} after cell {start}, replaying earlier cells")
+
+    path = os.path.dirname(os.path.abspath(notebook_path))
+    client = nbclient.NotebookClient(nb, timeout=timeout,
+                                     resources={'metadata': {'path': path}})
+    last_write = time.monotonic()
+    try:
+        with client.setup_kernel():
+            # Rebuild kernel state on copies, so checkpointed outputs stay
+            for index in range(start):
+                client.execute_cell(copy.deepcopy(nb.cells[index]), index)
+            for index in range(start, len(nb.cells)):
+                client.execute_cell(nb.cells[index], index)
+                state['executed_cells'] = index + 1
+                if time.monotonic() - last_write >= checkpoint:
+                    write_checkpoint(nb, notebook_path)
+                    last_write = time.monotonic()
+    except KeyboardInterrupt:
+        write_checkpoint(nb, notebook_path)
+        raise
+    except Exception as e:
+        write_checkpoint(nb, notebook_path)
+        timed_out = isinstance(e, nbclient.exceptions.CellTimeoutError)
+        METRICS.inc('py2nb_execution_failures', kind='timeout' if timed_out else 'kernel_error')
+        print(f"⚠ Notebook execution failed: {e}")
+        print(f"  Checkpoint after {state.get('executed_cells', 0)} cells available: {notebook_path}")
+        return execution_failed(notebook_path, check)
+
+    del nb.metadata['py2nb']
+    write_checkpoint(nb, notebook_path)
+    print(f"✓ Successfully executed notebook: {notebook_path}")
+    return notebook_path
+
+
+def nbconvert_command(notebook_path):
+    """Command line executing a notebook in place with nbconvert."""
+    return [
+        'jupyter', 'nbconvert',
+        '--to', 'notebook',
+        '--execute',
+        '--inplace',
+        notebook_path
+    ]
+
+
+def execute_notebook(notebook_path, checkpoint=None, resume=False, check=False):
+    """Execute a notebook using nbconvert and return the executed notebook path.
+
+    If ``checkpoint`` is given (in seconds, 0 for after every cell) or
+    ``resume`` is set, the notebook is instead executed with
+    `execute_with_checkpoints`. A failed execution is reported and the
+    notebook path returned, unless ``check`` is set, in which case it
+    raises ``RuntimeError``.
+    """
+    METRICS.inc('py2nb_executions')
+    start = time.monotonic()
+    try:
+        if checkpoint is not None or resume:
+            return execute_with_checkpoints(notebook_path, checkpoint or 0, resume,
+                                            check=check)
+        return execute_with_nbconvert(notebook_path, check=check)
+    finally:
+        METRICS.observe('py2nb_execution_seconds', time.monotonic() - start)
+
+
+def execution_failed(notebook_path, check):
+    """Return the path of a notebook that failed to execute, or raise if check."""
+    if check:
+        raise RuntimeError(f"Execution of {notebook_path} failed")
+    return notebook_path
+
+
+def failure_kind(stderr):
+    """Classify the error output of a failed nbconvert run."""
+    if 'jupyter-nbconvert` not found' in stderr:
+        return 'missing_jupyter'
+    return 'kernel_error'
+
+
+def execute_with_nbconvert(notebook_path, check=False):
+    """Execute a notebook in place with nbconvert."""
     executed_name = notebook_path
     
     try:
         # Use nbconvert to execute the notebook
-        cmd = [
-            'jupyter', 'nbconvert', 
-            '--to', 'notebook',
-            '--execute',
-            '--inplace',
-            notebook_path
-        ]
+        cmd = nbconvert_command(notebook_path)
         
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
         
@@ -212,26 +1240,372 @@ def execute_notebook(notebook_path):
             print(f"✓ Successfully executed notebook: {executed_name}")
             return executed_name
         else:
+            METRICS.inc('py2nb_execution_failures', kind=failure_kind(result.stderr))
             print(f"⚠ Notebook execution failed: {result.stderr}")
-            print(f"  Original notebook available: {notebook_path}")
-            return notebook_path
             
     except subprocess.TimeoutExpired:
+        METRICS.inc('py2nb_execution_failures', kind='timeout')
         print(f"⚠ Notebook execution timed out (5 minutes)")
-        print(f"  Original notebook available: {notebook_path}")
-        return notebook_path
     except FileNotFoundError:
+        METRICS.inc('py2nb_execution_failures', kind='missing_jupyter')
         print(f"⚠ jupyter nbconvert not found. Install with: pip install nbconvert")
-        print(f"  Original notebook available: {notebook_path}")
-        return notebook_path
     except Exception as e:
+        METRICS.inc('py2nb_execution_failures', kind='error')
         print(f"⚠ Error executing notebook: {e}")
-        print(f"  Original notebook available: {notebook_path}")
-        return notebook_path
+    print(f"  Original notebook available: {notebook_path}")
+    return execution_failed(notebook_path, check)
+
+
+def parse_size(size):
+    """Parse a memory size such as ``'512M'`` or ``'2G'`` into bytes."""
+    size = str(size).strip().upper().rstrip('B')
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def process_children():
+    """Map each process id to the ids of its children, from ``/proc``.
+
+    Returns an empty mapping where ``/proc`` is not available.
+    """
+    children = collections.defaultdict(list)
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after its ')'
+        ppid = int(stat.rsplit(b')', 1)[1].split()[1])
+        children[ppid].append(int(entry))
+    return children
+
+
+def process_tree_rss(pid, children=None):
+    """Resident memory in bytes of a process and all its descendants.
+
+    Reads ``/proc``, so this is Linux only; elsewhere it returns 0. Pass the
+    ``children`` of `process_children` to share one scan of ``/proc``
+    between several calls.
+    """
+    if children is None:
+        children = process_children()
+    if not children:
+        return 0
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            with open(f'/proc/{p}/statm', 'rb') as f:
+                total += int(f.read().split()[1]) * page_size
+        except OSError:
+            pass
+        stack.extend(children.get(p, ()))
+    return total
+
+
+def available_memory():
+    """Memory in bytes available to new processes, or None if unknown."""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class ExecutionScheduler:
+    """Run many notebook executions at once within CPU and memory limits.
+
+    Jobs are admitted while a CPU slot is free and the system has enough
+    memory available for the job's expected peak. Expected peaks and
+    runtimes are learned from previous runs and kept in a JSON ``history``
+    file. Jobs with the longest expected runtime start first, which
+    shortens the total time for the batch; jobs not seen before count as
+    longest. A job whose processes exceed ``memory_limit`` is killed and
+    requeued, up to ``retries`` times. Its recorded peak then holds it back
+    until enough memory is free.
+
+    Memory is measured through ``/proc``, so memory admission and limits
+    only take effect on Linux.
+
+    Parameters
+    ----------
+    slots: int, optional
+        Maximum number of concurrent jobs (default: number of CPUs)
+    memory_limit: int, optional
+        Per-job limit in bytes on the resident memory of the job's
+        process tree (default: no limit)
+    reserve: int, optional
+        Memory in bytes to keep free for the rest of the system
+    default_memory: int, optional
+        Expected peak memory in bytes of jobs without history
+    history: str, optional
+        JSON file recording the peak memory and runtime of each notebook
+    retries: int, optional
+        Number of times a job killed for exceeding ``memory_limit`` is
+        requeued
+    timeout: float, optional
+        Seconds after which a job is killed (default: 300)
+    command: callable, optional
+        Maps a notebook path to the command executing it
+        (default: `nbconvert_command`)
+    poll: float, optional
+        Seconds between checks on running jobs
+    """
+
+    def __init__(self, slots=None, memory_limit=None, reserve=2**29,
+                 default_memory=2**29, history=None, retries=1, timeout=300,
+                 command=nbconvert_command, poll=0.5):
+        self.slots = slots or os.cpu_count() or 1
+        self.memory_limit = memory_limit
+        self.reserve = reserve
+        self.default_memory = default_memory
+        self.history_file = history
+        self.retries = retries
+        self.timeout = timeout
+        self.command = command
+        self.poll = poll
+        self.history = {}
+        if history and os.path.exists(history):
+            with open(history, 'r', encoding='utf-8') as f:
+                self.history = json.load(f)
+        self.queue = []
+        self.running = []
+        self.results = {}
+        self.busy_time = 0.0
+        self.started = None
+
+    def submit(self, notebook_path):
+        """Add a notebook to the queue."""
+        self.queue.append({'path': notebook_path, 'attempts': 0})
+
+    def expected(self, job, key, default):
+        """Return a learned statistic of a job, or a default."""
+        return self.history.get(os.path.abspath(job['path']), {}).get(key, default)
+
+    @property
+    def queue_depth(self):
+        """Number of jobs waiting to be admitted."""
+        return len(self.queue)
+
+    @property
+    def utilisation(self):
+        """Fraction of slot time spent running jobs since `run` started."""
+        if self.started is None:
+            return 0.0
+        now = time.monotonic()
+        elapsed = now - self.started
+        busy = self.busy_time + sum(now - job['start'] for job in self.running)
+        return busy / (self.slots * elapsed) if elapsed > 0 else 0.0
 
+    def stats(self):
+        """Return a snapshot of the queue and utilisation."""
+        return {'queued': self.queue_depth,
+                'running': len(self.running),
+                'finished': len(self.results),
+                'slots': self.slots,
+                'utilisation': self.utilisation}
+
+    def admit(self):
+        """Start queued jobs while slots and memory allow."""
+        while self.queue and len(self.running) < self.slots:
+            job = self.queue[0]
+            need = self.expected(job, 'peak_rss', self.default_memory)
+            free = available_memory()
+            # Never hold back a job when nothing else is running
+            if self.running and free is not None and free - self.reserve < need:
+                break
+            self.queue.pop(0)
+            job['attempts'] += 1
+            job['start'] = time.monotonic()
+            job['peak_rss'] = 0
+            job['stderr'] = tempfile.TemporaryFile()
+            try:
+                job['process'] = subprocess.Popen(
+                    self.command(job['path']), stdout=subprocess.DEVNULL,
+                    stderr=job['stderr'], start_new_session=True)
+            except OSError as e:
+                job['stderr'].close()
+                METRICS.inc('py2nb_executions')
+                METRICS.inc('py2nb_execution_failures', kind='missing_jupyter')
+                self.results[job['path']] = {'status': 'failed', 'runtime': 0.0,
+                                             'peak_rss': 0, 'attempts': job['attempts'],
+                                             'error': str(e)}
+                continue
+            self.running.append(job)
+
+    def finish(self, job, status):
+        """Record a job that has stopped running, requeueing it if allowed."""
+        runtime = time.monotonic() - job['start']
+        self.busy_time += runtime
+        self.running.remove(job)
+        job['stderr'].seek(0)
+        error = job.pop('stderr').read().decode('utf-8', 'replace')
+        del job['process']
+
+        if status in ('done', 'killed'):
+            record = self.history.setdefault(os.path.abspath(job['path']), {})
+            record['peak_rss'] = job['peak_rss']
+            if status == 'done':
+                record['runtime'] = runtime
+
+        METRICS.inc('py2nb_executions')
+        METRICS.observe('py2nb_execution_seconds', runtime)
+        if status != 'done':
+            kind = {'killed': 'memory', 'timeout': 'timeout'}.get(status, failure_kind(error))
+            METRICS.inc('py2nb_execution_failures', kind=kind)
+
+        if status == 'killed' and job['attempts'] <= self.retries:
+            self.queue.append(job)
+            return
+        self.results[job['path']] = {'status': status,
+                                     'runtime': runtime,
+                                     'peak_rss': job['peak_rss'],
+                                     'attempts': job['attempts']}
+        if status != 'done':
+            self.results[job['path']]['error'] = error.strip()
+
+    def kill(self, job):
+        """Kill every process of a running job."""
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(job['process'].pid, signal.SIGKILL)
+        job['process'].wait()
+
+    def check(self):
+        """Update running jobs, killing those over their limits."""
+        children = process_children() if self.running else None
+        for job in list(self.running):
+            returncode = job['process'].poll()
+            if returncode is not None:
+                self.finish(job, 'done' if returncode == 0 else 'failed')
+                continue
+            job['peak_rss'] = max(job['peak_rss'], process_tree_rss(job['process'].pid, children))
+            if self.memory_limit and job['peak_rss'] > self.memory_limit:
+                self.kill(job)
+                self.finish(job, 'killed')
+            elif self.timeout and time.monotonic() - job['start'] > self.timeout:
+                self.kill(job)
+                self.finish(job, 'timeout')
+
+    def run(self):
+        """Run all queued jobs, returning a result for each notebook.
+
+        Returns
+        -------
+        dict
+            Maps each notebook path to its ``status`` (``'done'``,
+            ``'failed'``, ``'killed'`` or ``'timeout'``), ``runtime``,
+            ``peak_rss`` and ``attempts``
+        """
+        self.started = time.monotonic()
+        # Longest processing time first, unknown runtimes first of all
+        self.queue.sort(key=lambda job: -self.expected(job, 'runtime', float('inf')))
+        try:
+            while self.queue or self.running:
+                self.admit()
+                time.sleep(self.poll)
+                self.check()
+        finally:
+            for job in list(self.running):
+                self.kill(job)
+                self.finish(job, 'failed')
+            if self.history_file:
+                os.makedirs(os.path.dirname(os.path.abspath(self.history_file)), exist_ok=True)
+                atomic_write_json(self.history_file, self.history)
+        return self.results
+
+
+def line_index(nb):
+    """Build a sorted line-range index for a notebook converted with line_map.
+
+    Parameters
+    ----------
+    nb: dict or nbformat.notebooknode.NotebookNode
+        Notebook whose cells carry ``py2nb.lines`` metadata
+
+    Returns
+    -------
+    list of tuple
+        ``(first, last, cell_index, reach)`` for every mapped cell, ordered
+        by first script line, suitable for `cell_at_line`. ``reach`` is the
+        largest ``last`` of this and all earlier entries, since ranges may
+        overlap (a command cell continues across interleaved markdown lines)
+    """
+    ranges = []
+    for i, cell in enumerate(nb['cells']):
+        lines = cell.get('metadata', {}).get('py2nb', {}).get('lines')
+        if lines:
+            ranges.append((lines[0], lines[1], i))
+    ranges.sort()
+    index = []
+    reach = 0
+    for first, last, i in ranges:
+        reach = max(reach, last)
+        index.append((first, last, i, reach))
+    return index
+
+
+def cell_at_line(index, lineno):
+    """Return the index of the cell containing a script line, or None.
+
+    Where ranges overlap, the cell starting latest (the innermost) wins.
+
+    Parameters
+    ----------
+    index: list of tuple
+        Line-range index as produced by `line_index`
+    lineno: int
+        Script line number (1-based)
+    """
+    i = bisect.bisect_right(index, (lineno, float('inf'))) - 1
+    # Walk back only while some earlier range can still reach lineno
+    while i >= 0 and index[i][3] >= lineno:
+        if index[i][1] >= lineno:
+            return index[i][2]
+        i -= 1
+    return None
+
+
+def cell_lines(nb, cell_index):
+    """Return the ``(first, last)`` script lines of a cell, or None."""
+    lines = nb['cells'][cell_index].get('metadata', {}).get('py2nb', {}).get('lines')
+    if lines:
+        return tuple(lines)
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def schema_validator():
+    """Return the compiled nbformat 4.2 schema validator, built once."""
+    return nbformat.validator.get_validator(version=4, version_minor=2,
+                                            name='fastjsonschema')
+
+
+def validate_notebook(nb, strict=False):
+    """Validate notebook structure and fix common issues.
+
+    Notebooks built by `script_to_notebook` are valid by construction; this
+    fix-up pass is for notebooks from elsewhere. With ``strict``, the
+    notebook is instead checked against the nbformat schema, raising
+    ``nbformat.ValidationError`` on failure.
+    """
+    if strict:
+        schema_validator().validate(nb)
+        return
 
-def validate_notebook(nb):
-    """Validate notebook structure and fix common issues."""
     for i, cell in enumerate(nb.cells):
         # Ensure proper cell structure
         if not hasattr(cell, 'metadata'):
@@ -265,46 +1639,141 @@ def parse_args():
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument(
         "script_name",
-        help="name of script (.py) to convert to jupyter notebook (.ipynb)")
+        nargs="*",
+        help="name of script(s) (.py) to convert to jupyter notebook (.ipynb)")
     parser.add_argument(
         "--no-validate", 
         action="store_true",
         help="skip notebook validation")
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="check the notebook against the nbformat schema")
     parser.add_argument(
         "--execute", 
         action="store_true",
         help="execute the notebook after conversion")
+    parser.add_argument(
+        "--checkpoint",
+        nargs="?",
+        const=0,
+        type=float,
+        metavar="SECONDS",
+        help="with --execute, save the partially executed notebook after "
+             "every cell, or at most every SECONDS (requires nbclient)")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="with --execute, continue from a previous --checkpoint run")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="with --execute, run up to N notebooks at once, admitting them "
+             "as memory allows and longest first")
+    parser.add_argument(
+        "--memory-limit",
+        metavar="SIZE",
+        help="with --jobs, kill and requeue notebooks whose processes use "
+             "more than SIZE of memory (e.g. 2G)")
+    parser.add_argument(
+        "--history",
+        default=os.path.join(os.path.expanduser('~'), '.cache', 'py2nb', 'history.json'),
+        help="file recording the peak memory and runtime of executed "
+             "notebooks, used by --jobs (default: %(default)s)")
+    parser.add_argument(
+        "--shard-headings",
+        type=int,
+        metavar="LEVEL",
+        help="split the notebook into shards at markdown headings of LEVEL "
+             "or higher, plus an index notebook linking them")
+    parser.add_argument(
+        "--shard-cells",
+        type=int,
+        metavar="N",
+        help="split the notebook into shards of at most N cells")
+    parser.add_argument(
+        "--shard-bytes",
+        metavar="SIZE",
+        help="split the notebook into shards of at most SIZE of source (e.g. 1M)")
+    parser.add_argument(
+        "--shard-state",
+        metavar="NAMES",
+        help="comma-separated variables to pickle from each shard to the next")
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="write conversion and execution metrics to FILE in the "
+             "OpenMetrics text format")
     parser.add_argument(
         "--output", 
         help="specify output notebook filename (default: script_name.ipynb)")
+    parser.add_argument(
+        "--to",
+        default="ipynb",
+        help="comma-separated output targets from ipynb, md and py, all "
+             "written from one parse of the script (default: ipynb)")
+    parser.add_argument(
+        "--line-map",
+        action="store_true",
+        help="record the script lines each cell came from in cell metadata")
+    parser.add_argument(
+        "--archive",
+        metavar="OUTPUT",
+        help="treat script_name as a tar/zip archive (or - for stdin) and "
+             "write the converted notebooks to the OUTPUT archive")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of worker processes for --archive (default: CPU count)")
+    parser.add_argument(
+        "--queue",
+        metavar="DIR",
+        help="submit the scripts as jobs to the shared queue directory DIR, "
+             "work on them alongside other workers and write DIR/manifest.json")
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="process jobs from the --queue directory until it is drained")
+    parser.add_argument(
+        "--changed-since",
+        metavar="REF",
+        help="only convert scripts changed in git since REF (limited to the "
+             "given scripts, if any) and remove notebooks of deleted scripts")
     return parser.parse_args()
 
 
-def main():
-    """Main conversion function."""
-    args = parse_args()
-    
-    if not os.path.exists(args.script_name):
-        print(f"Error: File {args.script_name} not found")
+def run_conversion(args, script_name):
+    """Convert a single script from the command line, returning an exit code."""
+    if not os.path.exists(script_name):
+        print(f"Error: File {script_name} not found")
         return 1
     
     try:
-        notebook_name = convert(args.script_name, validate=not args.no_validate, execute=args.execute, output_name=args.output)
+        if args.shard_headings or args.shard_cells or args.shard_bytes:
+            paths = convert_sharded(
+                script_name, output_name=args.output,
+                headings=args.shard_headings, max_cells=args.shard_cells,
+                max_bytes=parse_size(args.shard_bytes) if args.shard_bytes else None,
+                state=args.shard_state.split(',') if args.shard_state else None,
+                validate=not args.no_validate, execute=args.execute,
+                line_map=args.line_map, strict=args.strict)
+            print(f"✓ Successfully converted {script_name} to {paths[0]} "
+                  f"with {len(paths) - 1} shards")
+            return 0
+
+        targets = args.to.split(',')
+        output_names = convert(script_name, validate=not args.no_validate, execute=args.execute, output_name=args.output, line_map=args.line_map, to=targets, strict=args.strict, checkpoint=args.checkpoint, resume=args.resume)
         if args.execute:
-            print(f"✓ Successfully converted and executed {args.script_name} to {notebook_name}")
+            print(f"✓ Successfully converted and executed {script_name} to {', '.join(output_names)}")
         else:
-            print(f"✓ Successfully converted {args.script_name} to {notebook_name}")
-        
-        # Validate the created notebook
-        if not args.no_validate:
-            try:
-                with open(notebook_name, 'r', encoding='utf-8') as f:
-                    json.load(f)
-                print("✓ Notebook JSON validation passed")
-            except json.JSONDecodeError as e:
-                print(f"⚠ Notebook JSON validation failed: {e}")
-                return 1
-                
+            print(f"✓ Successfully converted {script_name} to {', '.join(output_names)}")
+        if args.strict and not args.no_validate:
+            print("✓ Notebook schema validation passed")
+
+    except nbformat.ValidationError as e:
+        print(f"⚠ Notebook schema validation failed: {e}")
+        return 1
     except Exception as e:
         print(f"Error during conversion: {e}")
         return 1
@@ -312,5 +1781,141 @@ def main():
     return 0
 
 
+def run_scheduled(args):
+    """Convert scripts, then execute them with an ExecutionScheduler."""
+    try:
+        memory_limit = parse_size(args.memory_limit) if args.memory_limit else None
+    except ValueError:
+        print(f"Error: invalid memory limit {args.memory_limit!r}, use e.g. 512M or 4G")
+        return 1
+    scheduler = ExecutionScheduler(slots=args.jobs, memory_limit=memory_limit,
+                                   history=args.history)
+    status = 0
+    for script_name in args.script_name:
+        if not os.path.exists(script_name):
+            print(f"Error: File {script_name} not found")
+            status = 1
+            continue
+        try:
+            notebook_name = convert(script_name, validate=not args.no_validate,
+                                    output_name=args.output, line_map=args.line_map,
+                                    strict=args.strict)
+        except nbformat.ValidationError as e:
+            print(f"⚠ Notebook schema validation failed: {e}")
+            status = 1
+            continue
+        except Exception as e:
+            print(f"Error during conversion: {e}")
+            status = 1
+            continue
+        scheduler.submit(notebook_name)
+    if not scheduler.queue_depth:
+        return status
+    print(f"✓ Executing {scheduler.queue_depth} notebooks in {scheduler.slots} slots")
+
+    results = scheduler.run()
+    for notebook_name, result in results.items():
+        if result['status'] == 'done':
+            print(f"✓ Successfully executed notebook: {notebook_name} "
+                  f"({result['runtime']:.1f}s, {result['peak_rss'] / 2**20:.0f} MiB)")
+        else:
+            print(f"⚠ Notebook execution {result['status']}: {notebook_name}")
+            if result['error']:
+                print(f"  {result['error'].splitlines()[-1]}")
+            status = 1
+    print(f"✓ Slot utilisation {scheduler.utilisation:.0%}")
+    return status
+
+
+def main():
+    """Main conversion function."""
+    args = parse_args()
+    try:
+        return run_main(args)
+    finally:
+        if args.metrics:
+            METRICS.write_textfile(args.metrics)
+
+
+def run_main(args):
+    """Dispatch the command line arguments, returning an exit code."""
+
+    if args.worker:
+        if not args.queue:
+            print("Error: --worker requires --queue DIR")
+            return 1
+        count = run_worker(args.queue)
+        print(f"✓ Worker finished {count} jobs from {args.queue}")
+        return 0
+
+    if args.changed_since:
+        try:
+            changed, deleted = git_changes(args.changed_since, '.py')
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"Error: could not query git for changes since {args.changed_since}: {e}")
+            return 1
+        for script_name in deleted:
+            notebook_name = output_path(script_name)
+            if os.path.exists(notebook_name) and not os.path.exists(script_name):
+                os.remove(notebook_name)
+                print(f"✓ Removed stale notebook {notebook_name}")
+        if args.script_name:
+            selected = {os.path.abspath(name) for name in args.script_name}
+            changed = [name for name in changed if os.path.abspath(name) in selected]
+        if not changed:
+            print(f"✓ No scripts changed since {args.changed_since}")
+            return 0
+        args.script_name = changed
+
+    if not args.script_name:
+        print("Error: no script given")
+        return 1
+
+    if args.queue:
+        job_ids = submit_jobs(args.queue, args.script_name, execute=args.execute,
+                              validate=not args.no_validate, line_map=args.line_map)
+        print(f"✓ Submitted {len(job_ids)} jobs to {args.queue}")
+        # The coordinator works through the queue alongside any other workers
+        run_worker(args.queue)
+        results = wait_for_jobs(args.queue, job_ids)
+        failed = [r for r in results if r['status'] != 'done']
+        for r in failed:
+            print(f"⚠ Job for {r['script']} failed on {r['worker']}: {r['error']}")
+        print(f"✓ {len(results) - len(failed)} jobs done, manifest written to "
+              f"{os.path.join(args.queue, 'manifest.json')}")
+        return 1 if failed else 0
+
+    if args.archive:
+        if len(args.script_name) != 1:
+            print("Error: --archive takes a single input archive")
+            return 1
+        archive_name = args.script_name[0]
+        try:
+            count, failures = convert_archive(archive_name, args.archive,
+                                              validate=not args.no_validate,
+                                              line_map=args.line_map,
+                                              workers=args.workers)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print(f"Error: could not convert archive {archive_name}: {e}")
+            return 1
+        print(f"✓ Successfully converted {count} scripts from {archive_name} to {args.archive}")
+        if failures:
+            print(f"Error: {len(failures)} scripts in {archive_name} failed to convert")
+            return 1
+        return 0
+
+    if args.output and len(args.script_name) > 1:
+        print("Error: --output can only be used with a single script")
+        return 1
+
+    if args.execute and args.jobs:
+        return run_scheduled(args)
+
+    status = 0
+    for script_name in args.script_name:
+        status = max(status, run_conversion(args, script_name))
+    return status
+
+
 if __name__ == '__main__':
     exit(main())
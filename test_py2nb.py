@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 """Test suite for py2nb with enhanced features."""
 
+import io
 import os
+import shutil
+import tarfile
 import tempfile
 import json
+import zipfile
 import unittest
 from unittest.mock import patch
 import nbformat
@@ -22,9 +26,7 @@ class TestPy2nb(unittest.TestCase):
     def tearDown(self):
         """Clean up test fixtures."""
         # Clean up temporary files
-        for file in os.listdir(self.temp_dir):
-            os.remove(os.path.join(self.temp_dir, file))
-        os.rmdir(self.temp_dir)
+        shutil.rmtree(self.temp_dir)
 
     def create_test_script(self, content, filename="test_script.py"):
         """Create a test Python script."""
@@ -255,6 +257,22 @@ plt.plot(x)"""
                 self.assertIn('outputs', cell)
                 self.assertIn('execution_count', cell)
 
+    def test_strict_validation(self):
+        """Test schema validation with the cached compiled validator."""
+        script_content = """#| # Title
+#! pip install numpy
+import numpy as np"""
+
+        script_path = self.create_test_script(script_content)
+        notebook_path = py2nb.convert(script_path, strict=True, line_map=True)
+        nb = nbformat.read(notebook_path, as_version=4)
+        py2nb.validate_notebook(nb, strict=True)
+        self.assertIs(py2nb.schema_validator(), py2nb.schema_validator())
+
+        nb.cells[0]['outputs'] = []
+        with self.assertRaises(nbformat.ValidationError):
+            py2nb.validate_notebook(nb, strict=True)
+
     def test_no_validation_flag(self):
         """Test --no-validate command line flag."""
         script_content = """import numpy as np"""
@@ -265,6 +283,24 @@ plt.plot(x)"""
         notebook_path = py2nb.convert(script_path, validate=False)
         self.assertTrue(os.path.exists(notebook_path))
 
+    def test_line_endings(self):
+        """Test that CRLF and LF scripts give the same notebook."""
+        lines = ["#| # Title é", "import math", "#-", "#! pip install numpy", "x = 'ü'"]
+        notebooks = []
+        for i, newline in enumerate(['\n', '\r\n', '\r']):
+            script_path = os.path.join(self.temp_dir, f'script_{i}.py')
+            with open(script_path, 'w', encoding='utf-8', newline='') as f:
+                f.write(newline.join(lines) + newline)
+            with open(py2nb.convert(script_path), 'r', encoding='utf-8') as f:
+                notebooks.append(f.read())
+        self.assertEqual(notebooks[0], notebooks[1])
+        self.assertEqual(notebooks[0], notebooks[2])
+
+        # Empty scripts cannot be memory-mapped but still convert
+        script_path = self.create_test_script("", "empty.py")
+        nb = nbformat.read(py2nb.convert(script_path), as_version=4)
+        self.assertEqual(nb.cells, [])
+
     def test_comment_type_detection(self):
         """Test comment type detection functions."""
         self.assertEqual(py2nb.get_comment_type('#| markdown'), 'markdown')
@@ -372,6 +408,202 @@ print("Test passed!")"""
             # This is acceptable behavior for the test environment
             pass
 
+    def test_checkpoint_resume(self):
+        """Test checkpointed execution resuming after a failed cell."""
+        try:
+            import nbclient  # noqa: F401
+            import ipykernel  # noqa: F401
+        except ImportError:
+            self.skipTest("nbclient and ipykernel are required for execution")
+
+        script_content = """import os
+with open('ran.txt', 'a') as f:
+    f.write('ran')
+print('first')
+#-
+assert os.path.exists('go')
+#-
+print(os.path.basename('a/done'))"""
+
+        script_path = self.create_test_script(script_content)
+        notebook_path = py2nb.convert(script_path, execute=True, checkpoint=0)
+
+        nb = nbformat.read(notebook_path, as_version=4)
+        self.assertEqual(nb.metadata['py2nb']['executed_cells'], 1)
+        self.assertEqual(nb.cells[1].outputs[0]['output_type'], 'error')
+        first_outputs = nb.cells[0].outputs
+
+        # Resuming replays the completed cell to restore the import of os,
+        # keeping its checkpointed outputs
+        open(os.path.join(self.temp_dir, 'go'), 'w').close()
+        notebook_path = py2nb.convert(script_path, execute=True, resume=True)
+        nb = nbformat.read(notebook_path, as_version=4)
+        self.assertNotIn('py2nb', nb.metadata)
+        self.assertEqual(nb.cells[0].outputs, first_outputs)
+        self.assertEqual(nb.cells[1].outputs, [])
+        self.assertEqual(nb.cells[2].outputs[0]['text'], 'done\n')
+        with open(os.path.join(self.temp_dir, 'ran.txt')) as f:
+            self.assertEqual(f.read(), 'ranran')
+
+    def test_execution_scheduler(self):
+        """Test longest-first scheduling and history recording."""
+        import sys
+
+        jobs = []
+        for name, delay in [('short', 0), ('long', 0.3), ('medium', 0.1)]:
+            path = self.create_test_script(f"import time\ntime.sleep({delay})\n", f"{name}.py")
+            jobs.append(path)
+        history = os.path.join(self.temp_dir, 'history.json')
+        with open(history, 'w') as f:
+            json.dump({jobs[0]: {'runtime': 1}, jobs[1]: {'runtime': 3},
+                       jobs[2]: {'runtime': 2}}, f)
+
+        scheduler = py2nb.ExecutionScheduler(
+            slots=1, history=history, poll=0.01,
+            command=lambda path: [sys.executable, path])
+        for path in jobs:
+            scheduler.submit(path)
+        self.assertEqual(scheduler.queue_depth, 3)
+
+        results = scheduler.run()
+        self.assertEqual(list(results), [jobs[1], jobs[2], jobs[0]])
+        self.assertTrue(all(r['status'] == 'done' for r in results.values()))
+        self.assertEqual(scheduler.stats()['queued'], 0)
+        self.assertGreater(scheduler.utilisation, 0)
+
+        with open(history) as f:
+            recorded = json.load(f)
+        self.assertGreater(recorded[jobs[1]]['runtime'], 0.3)
+        self.assertLess(recorded[jobs[1]]['runtime'], 3)
+
+        # A script that fails to convert is reported, not raised
+        bad = os.path.join(self.temp_dir, 'bad.py')
+        with open(bad, 'wb') as f:
+            f.write(b"x = '\xff'\n")
+        history = os.path.join(self.temp_dir, 'cli_history.json')
+        with patch('sys.argv', ['py2nb', bad, '--execute', '--jobs', '1',
+                                '--history', history]):
+            self.assertEqual(py2nb.main(), 1)
+        # With nothing to execute, the scheduler does not run
+        self.assertFalse(os.path.exists(history))
+        with patch('sys.argv', ['py2nb', jobs[0], '--execute', '--jobs', '1',
+                                '--history', history, '--memory-limit', '4GiB']):
+            self.assertEqual(py2nb.main(), 1)
+
+    def test_execution_scheduler_memory_limit(self):
+        """Test that jobs over their memory limit are killed and requeued."""
+        import sys
+
+        if py2nb.available_memory() is None:
+            self.skipTest("memory accounting needs /proc")
+        children = py2nb.process_children()
+        self.assertIn(os.getpid(), children[os.getppid()])
+        self.assertGreater(py2nb.process_tree_rss(os.getpid(), children), 0)
+        path = self.create_test_script(
+            "import time\nx = bytearray(200 * 2**20)\ntime.sleep(10)\n", "hog.py")
+        scheduler = py2nb.ExecutionScheduler(
+            slots=1, memory_limit=50 * 2**20, retries=1, poll=0.05,
+            command=lambda path: [sys.executable, path])
+        scheduler.submit(path)
+        result = scheduler.run()[path]
+        self.assertEqual(result['status'], 'killed')
+        self.assertEqual(result['attempts'], 2)
+        self.assertGreater(result['peak_rss'], 50 * 2**20)
+
+    def test_metrics(self):
+        """Test conversion metrics in the OpenMetrics text format."""
+        metrics = py2nb.Metrics()
+        with patch.object(py2nb, 'METRICS', metrics):
+            script_path = self.create_test_script("#| # Title\n#! pip install numpy\nx = 1\n")
+            py2nb.convert(script_path)
+        metrics.observe('py2nb_execution_seconds', 7)
+
+        metrics_path = os.path.join(self.temp_dir, 'py2nb.prom')
+        metrics.write_textfile(metrics_path)
+        with open(metrics_path) as f:
+            text = f.read()
+        self.assertIn('# TYPE py2nb_files_converted counter', text)
+        self.assertIn('py2nb_files_converted_total{direction="py2nb"} 1', text)
+        for cell_type in ['markdown', 'command', 'code']:
+            self.assertIn(f'py2nb_cells_total{{type="{cell_type}"}} 1', text)
+        self.assertIn('py2nb_execution_seconds_bucket{le="5.0"} 0', text)
+        self.assertIn('py2nb_execution_seconds_bucket{le="10.0"} 1', text)
+        self.assertIn('py2nb_execution_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn('py2nb_execution_seconds_sum 7', text)
+        self.assertNotIn('py2nb_cache_hits', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_sharding(self):
+        """Test splitting a script into shard notebooks with an index."""
+        import math
+        import sys
+
+        script_content = """#| # Intro
+import math
+from os import path as osp
+x = 1
+codec = __import__('json')
+square = lambda v: v * v
+#| ## Details
+y = x + 1
+#| # Analysis
+z = math.sqrt(x + y)
+#-
+w = osp.join(codec.dumps(z), 'w')"""
+
+        script_path = self.create_test_script(script_content)
+        paths = py2nb.convert_sharded(script_path, headings=1,
+                                      state=['x', 'y', 'codec', 'square'])
+        base = script_path[:-3]
+        self.assertEqual(paths, [base + '.ipynb', base + '_01.ipynb', base + '_02.ipynb'])
+
+        index = nbformat.read(paths[0], as_version=4)
+        self.assertIn('1. [Intro](test_script_01.ipynb)', index.cells[0].source)
+        self.assertIn('2. [Analysis](test_script_02.ipynb)', index.cells[0].source)
+
+        first = nbformat.read(paths[1], as_version=4)
+        second = nbformat.read(paths[2], as_version=4)
+        self.assertEqual(len(first.cells), 5)
+        self.assertEqual(len(second.cells), 5)
+        self.assertEqual(first.cells[-1].metadata.tags, ['py2nb-state'])
+        self.assertIn("pickle.dump", first.cells[-1].source)
+        self.assertEqual(second.cells[0].metadata.tags, ['py2nb-imports'])
+        self.assertEqual(second.cells[0].source,
+                         "import math\nfrom os import path as osp")
+        self.assertIn("test_script_state_01.pkl", second.cells[1].source)
+
+        # Imports and state (modules by name, unpicklable values skipped)
+        # carry over from one shard to the next
+        namespace = {}
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            for path in paths[1:]:
+                namespace = {}
+                for cell in nbformat.read(path, as_version=4).cells:
+                    if cell.cell_type == 'code':
+                        exec(cell.source, namespace)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(namespace['w'], os.path.join(json.dumps(math.sqrt(3)), 'w'))
+        self.assertNotIn('square', namespace)
+
+        # Executing the shards stops at the first failure
+        executed = []
+        def command(path):
+            executed.append(path)
+            return [sys.executable, '-c', 'raise SystemExit(1)']
+        with patch.object(py2nb, 'nbconvert_command', command):
+            with self.assertRaises(RuntimeError):
+                py2nb.convert_sharded(script_path, headings=1, execute=True)
+        self.assertEqual(executed, paths[1:2])
+
+        # Cell and byte budgets
+        cells = py2nb.script_to_notebook(script_content.splitlines(True)).cells
+        self.assertEqual([len(s) for s in py2nb.shard_cells(cells, max_cells=3)], [3, 3, 1])
+        self.assertEqual([len(s) for s in py2nb.shard_cells(cells, max_bytes=20)],
+                         [1, 1, 2, 1, 1, 1])
+
     def test_custom_output_name(self):
         """Test custom output filename functionality."""
         script_content = """#| # Custom Output Test
@@ -390,6 +622,370 @@ result = math.sqrt(4)"""
         self.assertTrue(custom_notebook2.endswith("custom_name2.ipynb"))
         self.assertTrue(os.path.exists(custom_notebook2))
 
+    def test_line_map(self):
+        """Test cell to script line mapping with line_map=True."""
+        script_content = """#| # Title
+#| More text
+
+import math
+
+x = math.sqrt(4)
+#-
+y = x + 1"""
+
+        script_path = self.create_test_script(script_content)
+        notebook_path = py2nb.convert(script_path, line_map=True)
+
+        with open(notebook_path, 'r') as f:
+            nb = json.load(f)
+
+        self.assertEqual(py2nb.cell_lines(nb, 0), (1, 2))
+        self.assertEqual(py2nb.cell_lines(nb, 1), (4, 6))
+        self.assertEqual(py2nb.cell_lines(nb, 2), (8, 8))
+
+        index = py2nb.line_index(nb)
+        self.assertEqual(py2nb.cell_at_line(index, 1), 0)
+        self.assertEqual(py2nb.cell_at_line(index, 5), 1)
+        self.assertEqual(py2nb.cell_at_line(index, 8), 2)
+        self.assertIsNone(py2nb.cell_at_line(index, 3))
+        self.assertIsNone(py2nb.cell_at_line(index, 7))
+        self.assertIsNone(py2nb.cell_at_line(index, 100))
+
+        # Command cells continue across interleaved markdown lines
+        script_path = self.create_test_script("x = 1\n\n\n#! a\n#| mid\n#! b\ny = 2\n")
+        with open(py2nb.convert(script_path, line_map=True), 'r') as f:
+            nb = json.load(f)
+        self.assertEqual(py2nb.cell_lines(nb, 1), (5, 5))
+        self.assertEqual(py2nb.cell_lines(nb, 2), (4, 6))
+        index = py2nb.line_index(nb)
+        self.assertEqual(py2nb.cell_at_line(index, 4), 2)
+        self.assertEqual(py2nb.cell_at_line(index, 5), 1)
+        self.assertEqual(py2nb.cell_at_line(index, 6), 2)
+        self.assertEqual(py2nb.cell_at_line(index, 7), 3)
+        self.assertIsNone(py2nb.cell_at_line(index, 2))
+
+        # Without line_map no py2nb metadata is written
+        notebook_path = py2nb.convert(script_path)
+        with open(notebook_path, 'r') as f:
+            nb = json.load(f)
+        self.assertEqual(py2nb.line_index(nb), [])
+
+    def test_convert_archive(self):
+        """Test streaming conversion of tar and zip archives."""
+        import nb2py
+
+        scripts = {'a.py': "#| # A\nx = 1\n", 'sub/b.py': "y = 2\n#-\nz = 3\n",
+                   'README.txt': "not a script\n", 'bad.py': b"x = '\xff'\n"}
+        tar_path = os.path.join(self.temp_dir, 'scripts.tar.gz')
+        with tarfile.open(tar_path, 'w:gz') as tf:
+            for name, content in scripts.items():
+                data = content if isinstance(content, bytes) else content.encode('utf-8')
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+
+        zip_path = os.path.join(self.temp_dir, 'notebooks.zip')
+        count, failures = py2nb.convert_archive(tar_path, zip_path,
+                                                workers=2, window=1)
+        self.assertEqual(count, 2)
+        self.assertEqual(failures, ['bad.py'])
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertEqual(zf.namelist(), ['a.ipynb', 'sub/b.ipynb'])
+            nb = json.loads(zf.read('sub/b.ipynb'))
+        self.assertEqual(len(nb['cells']), 2)
+
+        # And back again, from zip to tar
+        out_path = os.path.join(self.temp_dir, 'scripts.tar')
+        count, failures = nb2py.convert_archive(zip_path, out_path, workers=2)
+        self.assertEqual((count, failures), (2, []))
+        with tarfile.open(out_path) as tf:
+            self.assertEqual(tf.getnames(), ['a.py', 'sub/b.py'])
+            script = tf.extractfile('a.py').read().decode('utf-8')
+        self.assertIn('#| # A', script)
+        self.assertIn('x = 1', script)
+
+        # A failed member makes the command line exit non-zero
+        with patch('sys.argv', ['py2nb', tar_path, '--archive', zip_path]):
+            self.assertEqual(py2nb.main(), 1)
+
+        # As does an unreadable input, leaving no partial output behind
+        corrupt = os.path.join(self.temp_dir, 'corrupt.tar')
+        with open(corrupt, 'wb') as f:
+            f.write(b'not an archive')
+        broken = os.path.join(self.temp_dir, 'broken.zip')
+        for name in [os.path.join(self.temp_dir, 'missing.tar'), corrupt]:
+            with patch('sys.argv', ['py2nb', name, '--archive', broken]):
+                self.assertEqual(py2nb.main(), 1)
+            with patch('sys.argv', ['nb2py', name, '--archive', broken]):
+                self.assertEqual(nb2py.main(), 1)
+            self.assertFalse(os.path.exists(broken))
+        with patch('sys.argv', ['nb2py', zip_path, corrupt, '--archive', broken]):
+            self.assertEqual(nb2py.main(), 1)
+
+    def test_work_queue(self):
+        """Test several workers draining a shared queue directory."""
+        import threading
+
+        queue_dir = os.path.join(self.temp_dir, 'queue')
+        scripts = [self.create_test_script(f"x = {i}\n", f"script_{i}.py")
+                   for i in range(6)]
+        scripts.append(os.path.join(self.temp_dir, 'missing.py'))
+        job_ids = py2nb.submit_jobs(queue_dir, scripts)
+        self.assertEqual(len(job_ids), 7)
+
+        counts = []
+        workers = [threading.Thread(target=lambda i=i: counts.append(
+                       py2nb.run_worker(queue_dir, worker_id=f'w{i}', poll=0.01)))
+                   for i in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sum(counts), 7)
+
+        results = py2nb.wait_for_jobs(queue_dir, poll=0.01)
+        self.assertEqual([r['job'] for r in results], job_ids)
+        statuses = [r['status'] for r in results]
+        self.assertEqual(statuses, ['done'] * 6 + ['failed'])
+        self.assertIn('FileNotFoundError', results[-1]['error'])
+        for script in scripts[:-1]:
+            self.assertTrue(os.path.exists(script[:-3] + '.ipynb'))
+        with open(os.path.join(queue_dir, 'manifest.json')) as f:
+            self.assertEqual(json.load(f), results)
+
+        # A later run in the same queue directory reports only its own jobs
+        with patch('sys.argv', ['py2nb', scripts[0], '--queue', queue_dir]):
+            self.assertEqual(py2nb.main(), 0)
+        with open(os.path.join(queue_dir, 'manifest.json')) as f:
+            results = json.load(f)
+        self.assertEqual([r['script'] for r in results], [scripts[0]])
+
+    def test_work_queue_execution_failure(self):
+        """Test that a job whose execution fails is recorded as failed."""
+        import sys
+
+        queue_dir = os.path.join(self.temp_dir, 'queue')
+        script = self.create_test_script("raise ValueError('boom')\n")
+        py2nb.submit_jobs(queue_dir, [script], execute=True)
+        with patch.object(py2nb, 'nbconvert_command',
+                          lambda path: [sys.executable, '-c', 'raise SystemExit(1)']):
+            self.assertEqual(py2nb.run_worker(queue_dir, poll=0.01), 1)
+        results = py2nb.write_manifest(queue_dir)
+        self.assertEqual(results[0]['status'], 'failed')
+        self.assertIn('RuntimeError', results[0]['error'])
+
+    def test_work_queue_reclaims_stale_jobs(self):
+        """Test that jobs claimed by a dead worker are reclaimed."""
+        queue_dir = os.path.join(self.temp_dir, 'queue')
+        script = self.create_test_script("x = 1\n")
+        py2nb.submit_jobs(queue_dir, [script])
+
+        # Simulate a worker that claimed the job and died
+        claimed = py2nb.claim_job(queue_dir, 'dead')
+        os.utime(claimed, (0, 0))
+        self.assertIsNone(py2nb.claim_job(queue_dir, 'dead'))
+
+        # Once reclaimed and claimed again, the old claim is no longer there
+        # to be removed by the slow worker, while the new one is untouched
+        self.assertEqual(py2nb.reclaim_stale(queue_dir), 1)
+        reclaimed = py2nb.claim_job(queue_dir, 'slow')
+        self.assertNotEqual(reclaimed, claimed)
+        self.assertFalse(os.path.exists(claimed))
+        os.utime(reclaimed, (0, 0))
+
+        self.assertEqual(py2nb.run_worker(queue_dir, stale=60, poll=0.01), 1)
+        results = py2nb.write_manifest(queue_dir)
+        self.assertEqual(results[0]['status'], 'done')
+
+    def test_git_changes(self):
+        """Test detection of scripts changed in git since a reference."""
+        import subprocess
+
+        def git(*args):
+            subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+                           + list(args), cwd=self.temp_dir, check=True, capture_output=True)
+
+        git('init', '-q')
+        for name in ['keep.py', 'edit.py', 'gone.py', 'old.py', 'notes.txt']:
+            self.create_test_script(f"# {name}\nx = 1\n", name)
+        git('add', '.')
+        git('commit', '-q', '-m', 'initial')
+
+        self.create_test_script("x = 2\n", 'edit.py')
+        self.create_test_script("y = 1\n", 'new.py')
+        self.create_test_script("z = 1\n", 'notes.txt')
+        os.remove(os.path.join(self.temp_dir, 'gone.py'))
+        git('mv', 'old.py', 'renamed.py')
+
+        changed, deleted = py2nb.git_changes('HEAD', '.py', cwd=self.temp_dir)
+        self.assertEqual(sorted(changed), ['edit.py', 'new.py', 'renamed.py'])
+        self.assertEqual(sorted(deleted), ['gone.py', 'old.py'])
+
+        # nb2py restricts changed notebooks to those given, like py2nb
+        import nb2py
+        for name in ['a', 'b']:
+            script = self.create_test_script("x = 1\n", f'{name}.py')
+            py2nb.convert(script)
+            os.remove(script)
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            with patch('sys.argv', ['nb2py', '--changed-since', 'HEAD', 'a.ipynb']):
+                self.assertEqual(nb2py.main(), 0)
+        finally:
+            os.chdir(cwd)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, 'a.py')))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'b.py')))
+
+    def test_multiple_targets(self):
+        """Test writing notebook, markdown and script from one conversion."""
+        import nb2py
+
+        script_content = """#| # Title
+
+#! pip install numpy
+import numpy as np
+#-
+x = np.ones(3)"""
+
+        script_path = self.create_test_script(script_content)
+        output_name = os.path.join(self.temp_dir, 'out.ipynb')
+        paths = py2nb.convert(script_path, output_name=output_name,
+                              to=['ipynb', 'md', 'py'])
+        base = os.path.join(self.temp_dir, 'out')
+        self.assertEqual(paths, [base + '.ipynb', base + '.md', base + '.py'])
+
+        with open(base + '.md') as f:
+            markdown = f.read()
+        self.assertTrue(markdown.startswith('# Title\n'))
+        self.assertIn('```python\n!pip install numpy\n```', markdown)
+        self.assertIn('```python\nx = np.ones(3)\n```', markdown)
+
+        # The script target matches a round trip through nb2py
+        roundtrip = nb2py.convert(base + '.ipynb',
+                                  output_name=os.path.join(self.temp_dir, 'roundtrip.py'))
+        with open(base + '.py') as f, open(roundtrip) as g:
+            self.assertEqual(f.read(), g.read())
+
+        # A single target still returns a single path
+        self.assertEqual(py2nb.convert(script_path, to='md'), script_path[:-3] + '.md')
+
+        # The script itself is never overwritten
+        with self.assertRaises(ValueError):
+            py2nb.convert(script_path, to='py')
+        with self.assertRaises(ValueError):
+            py2nb.convert(script_path, to=['ipynb', 'html'])
+        with self.assertRaises(ValueError):
+            py2nb.convert(script_path, to=['ipynb', 'md', 'py'])
+        # ... and no target is written unless all of them can be
+        self.assertFalse(os.path.exists(script_path[:-3] + '.ipynb'))
+
+    def test_strip_outputs(self):
+        """Test streaming output stripping against nbformat serialisation."""
+        import nb2py
+
+        nb = nbformat.v4.new_notebook(nbformat_minor=2)
+        nb.cells = [nbformat.v4.new_markdown_cell('# "outputs": [1]'),
+                    nbformat.v4.new_code_cell('print("[{}]")', execution_count=3, outputs=[
+                        nbformat.v4.new_output('stream', text='"outputs": [\\"]\n'),
+                        nbformat.v4.new_output('execute_result', {'text/plain': '{1: [2]}'},
+                                               execution_count=3)])]
+        nb.metadata['outputs'] = ['kept']
+        for cell in nb.cells:
+            del cell['id']
+        data = nbformat.v4.writes(nb).encode('utf-8')
+
+        changed, chunks = nb2py.strip_outputs(data)
+        self.assertTrue(changed)
+        nb.cells[1].outputs = []
+        nb.cells[1].execution_count = None
+        self.assertEqual(b''.join(chunks).decode('utf-8'), nbformat.v4.writes(nb))
+
+        changed, chunks = nb2py.strip_outputs(b''.join(chunks))
+        self.assertFalse(changed)
+
+        # Clean notebooks in other layouts are left exactly as they are
+        for layout in [b'"execution_count":null,"outputs":[]',
+                       b'"outputs": [ ], "execution_count": null\n  ']:
+            clean = b'{"cells": [{"cell_type": "code", ' + layout + b'}]}'
+            changed, chunks = nb2py.strip_outputs(clean)
+            self.assertFalse(changed)
+            self.assertEqual(b''.join(chunks), clean)
+        changed, chunks = nb2py.strip_outputs(
+            b'{"cells": [{"execution_count":7\n ,"outputs":[1]}]}')
+        self.assertTrue(changed)
+        self.assertEqual(b''.join(chunks),
+                         b'{"cells": [{"execution_count":null\n ,"outputs":[]}]}')
+
+    def test_pre_commit(self):
+        """Test the pre-commit hook on staged notebooks."""
+        import subprocess
+        import nb2py
+
+        def git(*args):
+            return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+                                  + list(args), cwd=self.temp_dir, check=True,
+                                  capture_output=True, text=True).stdout
+
+        git('init', '-q')
+        script_path = self.create_test_script("#| # Title\nx = 1\n#-\nprint(x)\n", 'paired.py')
+        notebook_path = py2nb.convert(script_path)
+        nb = nbformat.read(notebook_path, as_version=4)
+        nb.cells[1].execution_count = 1
+        nb.cells[1].outputs = [nbformat.v4.new_output('stream', text='1\n')]
+        nb.cells[2].source = 'print(x + 1)'
+        nbformat.write(nb, notebook_path)
+        other = os.path.join(self.temp_dir, 'unstaged.ipynb')
+        nbformat.write(nb, other)
+        git('add', 'paired.ipynb')
+        # An unstaged edit on top of the staged notebook
+        nb.cells[2].source = 'print(x + 999)'
+        nbformat.write(nb, notebook_path)
+
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            modified = nb2py.pre_commit()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(sorted(modified), ['paired.ipynb', 'paired.py'])
+
+        staged = json.loads(git('show', ':paired.ipynb'))
+        self.assertEqual(staged['cells'][1]['outputs'], [])
+        self.assertIsNone(staged['cells'][1]['execution_count'])
+        self.assertEqual(''.join(staged['cells'][2]['source']), 'print(x + 1)')
+        staged_script = git('show', ':paired.py')
+        self.assertIn('print(x + 1)', staged_script)
+        self.assertNotIn('999', staged_script)
+        # The unstaged edit stays in the working tree only
+        working = nbformat.read(notebook_path, as_version=4)
+        self.assertEqual(working.cells[2].source, 'print(x + 999)')
+        self.assertEqual(working.cells[1].execution_count, 1)
+        # Notebooks that are not staged are left alone
+        self.assertEqual(nbformat.read(other, as_version=4).cells[1].execution_count, 1)
+
+        # Without unstaged edits, the working tree is stripped as well
+        git('add', 'paired.ipynb')
+        os.chdir(self.temp_dir)
+        try:
+            nb2py.pre_commit()
+        finally:
+            os.chdir(cwd)
+        working = nbformat.read(notebook_path, as_version=4)
+        self.assertIsNone(working.cells[1].execution_count)
+        self.assertEqual(git('diff', '--name-only', '--', 'paired.ipynb'), '')
+        self.assertIn('print(x + 999)', git('show', ':paired.py'))
+
+        # Outside a git repository the hook fails cleanly
+        outside = tempfile.mkdtemp()
+        os.chdir(outside)
+        try:
+            with patch('sys.argv', ['nb2py', '--pre-commit']):
+                self.assertEqual(nb2py.main(), 1)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(outside)
+
     def test_nb2py_custom_output(self):
         """Test nb2py with custom output names."""
         # Create a simple notebook first  